@@ -0,0 +1,106 @@
+from collections import defaultdict
+from fastapi import HTTPException, status
+import logging
+import threading
+import time
+
+ERROR_IN_FLIGHT = "Too many executions in flight for flavour"
+ERROR_QUEUE_DEPTH = "Too many executions queued for flavour"
+ERROR_TOO_MANY = "More executions than accepted at once for flavour"
+
+
+class AdmissionController:
+    """Rejects executions of saturated flavours instead of queueing them behind a growing backlog.
+
+    Executions are refused when the requests waiting in the flavour queue, or the executions this
+    worker is waiting for on the flavour, exceed their limit. Queue depths are read from the broker
+    at most once per depth TTL while they admit executions, and read again before rejecting any, so
+    a queue drained since the last read is not mistaken for a full one.
+    """
+
+    def __init__(self, logger: logging.Logger, max_in_flight: int, max_queue_depth: int,
+                 depth_ttl: float, retry_after: int):
+        """
+        Args:
+            max_in_flight (int): Executions awaited per flavour, 0 for no limit
+            max_queue_depth (int): Requests waiting in a flavour queue, 0 for no limit
+            depth_ttl (float): Seconds a queue depth read from the broker is trusted
+            retry_after (int): Seconds rejected clients are told to wait before retrying
+        """
+        self.logger = logger
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.depth_ttl = depth_ttl
+        self.retry_after = retry_after
+
+        self.in_flight: dict[str, int] = defaultdict(int)
+        self.depths: dict[str, tuple[float, int]] = {}
+        self.lock = threading.Lock()
+
+    def queue_depth(self, flavour: str, count: int = 1) -> int | None:
+        """Known depth of the flavour queue, None if it has to be read from the broker
+
+        Args:
+            count (int, optional): Executions to admit, depths that would reject them are read
+                again. Defaults to 1.
+        """
+        if self.max_queue_depth <= 0:
+            return 0
+
+        with self.lock:
+            entry = self.depths.get(flavour)
+
+        if entry is None or entry[0] < time.monotonic() or entry[1] + count > self.max_queue_depth:
+            return None
+
+        return entry[1]
+
+    def update_queue_depth(self, flavour: str, depth: int):
+        with self.lock:
+            self.depths[flavour] = (time.monotonic() + self.depth_ttl, depth)
+
+    def admit(self, flavour: str, count: int, depth: int, in_flight: bool = True):
+        """Accept executions for a flavour
+
+        Args:
+            flavour (str): Flavour the executions are requested to
+            count (int): Number of executions
+            depth (int): Requests waiting in the flavour queue
+            in_flight (bool, optional): Whether the executions will be awaited and must be released.
+                Defaults to True.
+
+        Raises:
+            HTTPException: 413 if the executions exceed a limit on their own, 503 if the flavour
+                queue is full, 429 if too many executions are in flight
+        """
+        limits = [limit for limit in (self.max_queue_depth, self.max_in_flight if in_flight else 0) if limit > 0]
+
+        if limits and count > min(limits):
+            # never admitted, however empty the queue is
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"{ERROR_TOO_MANY} {flavour}, at most {min(limits)}")
+
+        with self.lock:
+            if self.max_queue_depth > 0 and depth + count > self.max_queue_depth:
+                self.reject(status.HTTP_503_SERVICE_UNAVAILABLE, ERROR_QUEUE_DEPTH, flavour, depth)
+
+            if in_flight:
+                if self.max_in_flight > 0 and self.in_flight[flavour] + count > self.max_in_flight:
+                    self.reject(status.HTTP_429_TOO_MANY_REQUESTS, ERROR_IN_FLIGHT, flavour,
+                                self.in_flight[flavour])
+
+                self.in_flight[flavour] += count
+
+    def release(self, flavour: str, count: int = 1):
+        """Stop accounting awaited executions of a flavour"""
+        with self.lock:
+            self.in_flight[flavour] -= count
+
+            if self.in_flight[flavour] <= 0:
+                del self.in_flight[flavour]
+
+    def reject(self, status_code: int, error: str, flavour: str, load: int):
+        self.logger.warning(f"Rejecting executions for flavour {flavour}: {error} ({load})")
+
+        raise HTTPException(status_code=status_code, detail=f"{error} {flavour}",
+                            headers={"Retry-After": str(self.retry_after)})
@@ -1,60 +1,209 @@
 from biscuit_auth import Authorizer, Biscuit, PublicKey
 from datetime import datetime, timezone
 import requests
-import sys
+import threading
+import hashlib
+import logging
+import time
 import re
 
+from cache import TTLCache
+
 KEY_PATH = None
-public_key = None
+KEY_TIMEOUT = 5  # seconds to wait for the Cognit Frontend when fetching the public key
+REFRESH_INTERVAL = 300  # seconds between periodic public key refreshes
+REFRESH_MIN_INTERVAL = 10  # seconds between refreshes forced by tokens failing verification
+GRACE_PERIOD = 3600  # seconds the previous public key is trusted after a rotation
+
+# current public key first, then the one it replaced so tokens issued before a rotation remain valid
+# until the grace period ends
+public_keys: list[PublicKey] = []
+public_key_hex: str = None
+previous_key_expiry = 0.0  # time.monotonic() after which the previous key is dropped
+
+logger: logging.Logger = None
+
+# Credentials of already verified tokens, keyed by token hash. Disabled when None
+TOKEN_CACHE: TTLCache = None
+
+# expiration checks added by the Cognit Frontend, e.g. check if time($time), $time < 2024-10-18T13:41:28Z;
+EXPIRATION_CHECK = re.compile(r'time\(\$(\w+)\).*?\$\1\s*<=?\s*(\d{4}-\d{2}-\d{2}T[\d:.]+(?:Z|[+-]\d{2}:\d{2}))')
+
+_refresh_requested = threading.Event()
+_refresher_stopped = threading.Event()
+_last_refresh = 0.0
+
+
+def fetch_key() -> str:
+    """Fetch the public key used for token verification from the Cognit Frontend
+
+    Returns:
+        str: Hex encoded public key
+    """
+    response = requests.get(KEY_PATH, timeout=KEY_TIMEOUT)
+
+    if response.status_code != 200:
+        raise Exception(f"Error {response.status_code}\n{response.text}")
+
+    return response.json()
 
 
 def load_key():
-    """Load public key from Cognit Frontend for token verification
+    """Load public key from Cognit Frontend for token verification, unless one is already loaded
+
+    Raises:
+        Exception: If the Cognit Frontend cannot be reached
     """
-    global public_key
+    global _last_refresh
 
-    try:
-        response = requests.get(KEY_PATH)
+    if public_keys:
+        return
 
-        if response.status_code != 200:
-            raise f"Error {response.status_code}\n{response.json()}"
+    _last_refresh = time.monotonic()
 
+    try:
+        public_key_hex_string = fetch_key()
     except Exception as e:
-        detail = f"Cannot load public key for biscuit token authentication from {KEY_PATH}\n{str(e)}"
-        sys.stderr.write(detail)
-        exit(1)
+        raise Exception(
+            f"Cannot load public key for biscuit token authentication from {KEY_PATH}: {e}") from e
 
-    public_key_hex_string = response.json()
+    update_key(public_key_hex_string)
 
-    public_key = PublicKey.from_hex(public_key_hex_string)
 
+def probe_key():
+    """Ensure the Cognit Frontend serves the public key, loading it if none is loaded yet
 
-def authorize_token(token64: str) -> list[str]:
-    attempted = False
+    Raises:
+        Exception: If the Cognit Frontend cannot be reached
+    """
+    if not public_keys:
+        load_key()
+        return
+
+    try:
+        fetch_key()
+    except Exception as e:
+        raise Exception(f"Cannot fetch public key from {KEY_PATH}: {e}") from e
 
-    token = Biscuit.from_base64(token64, public_key)
 
-    def attempt_authorization():
-        authorizer = Authorizer("""
-        time({now});
-        allow if user($u), password($p);
-        """,
-                                {
-                                    'now': datetime.now(tz=timezone.utc)
-                                })
-        authorizer.add_token(token)
-        authorizer.authorize()
+def refresh_key():
+    """Reload the public key, keeping the current one if the Cognit Frontend cannot be reached
+    """
+    global _last_refresh
+
+    _last_refresh = time.monotonic()
 
     try:
-        attempt_authorization()
+        update_key(fetch_key())
     except Exception as e:
-        if attempted is True:  # maybe the key has been renewed
-            raise e
+        logger.warning(
+            f"Cannot refresh public key for biscuit token authentication from {KEY_PATH}: {e}")
 
-        attempted = True
 
-        load_key()
-        attempt_authorization()
+def update_key(public_key_hex_string: str):
+    global public_keys, public_key_hex, previous_key_expiry
+
+    if public_key_hex_string == public_key_hex:
+        return
+
+    public_keys = [PublicKey.from_hex(public_key_hex_string)] + (public_keys[:1] if GRACE_PERIOD > 0 else [])
+    public_key_hex = public_key_hex_string
+    previous_key_expiry = time.monotonic() + GRACE_PERIOD
+
+    logger.info("Loaded new public key for biscuit token authentication")
+
+    # tokens verified with a previous key must be verified again
+    if TOKEN_CACHE is not None:
+        TOKEN_CACHE.clear()
+
+
+def expire_previous_key():
+    """Stop trusting the key replaced by the current one once the grace period has passed"""
+    global public_keys
+
+    if len(public_keys) < 2 or time.monotonic() < previous_key_expiry:
+        return
+
+    public_keys = public_keys[:1]
+
+    logger.info("Dropped previous public key for biscuit token authentication")
+
+    # tokens verified with the previous key must not be served from the cache anymore
+    if TOKEN_CACHE is not None:
+        TOKEN_CACHE.clear()
+
+
+def request_refresh():
+    """Ask the refresher for an early key reload without waiting for it. Requests arriving
+    less than REFRESH_MIN_INTERVAL after the last reload are ignored.
+    """
+    if time.monotonic() - _last_refresh >= REFRESH_MIN_INTERVAL:
+        _refresh_requested.set()
+
+
+def start_key_refresher():
+    _refresher_stopped.clear()
+    threading.Thread(target=_refresh_periodically,
+                     name="key-refresher", daemon=True).start()
+
+
+def stop_key_refresher():
+    _refresher_stopped.set()
+    _refresh_requested.set()
+
+
+def _refresh_periodically():
+    while True:
+        _refresh_requested.wait(timeout=REFRESH_INTERVAL)
+        _refresh_requested.clear()
+
+        if _refresher_stopped.is_set():
+            return
+
+        refresh_key()
+
+
+def verify_token(token64: str) -> Biscuit:
+    """Parse a token checking it was signed by a trusted key
+
+    Raises:
+        Exception: If no trusted key verifies the token signature
+    """
+    error = Exception("No public key available for token verification")
+
+    for public_key in public_keys:
+        try:
+            return Biscuit.from_base64(token64, public_key)
+        except Exception as e:
+            error = e
+
+    # maybe the key has been renewed
+    request_refresh()
+
+    raise error
+
+
+def authorize_token(token64: str) -> list[str]:
+    expire_previous_key()
+
+    if TOKEN_CACHE is not None:
+        token_hash = hashlib.sha256(token64.encode()).digest()
+        credentials = TOKEN_CACHE.get(token_hash)
+
+        if credentials is not None:
+            return list(credentials)
+
+    token = verify_token(token64)
+
+    authorizer = Authorizer("""
+    time({now});
+    allow if user($u), password($p);
+    """,
+                            {
+                                'now': datetime.now(tz=timezone.utc)
+                            })
+    authorizer.add_token(token)
+    authorizer.authorize()
 
     token_body = token.block_source(0)
 
@@ -67,4 +216,25 @@ def authorize_token(token64: str) -> list[str]:
         if match:
             credentials.append(match.group(1))
 
+    if TOKEN_CACHE is not None:
+        ttl = min(TOKEN_CACHE.ttl, token_lifetime(token))
+
+        if ttl > 0:
+            TOKEN_CACHE.set(token_hash, tuple(credentials), ttl=ttl)
+
     return credentials
+
+
+def token_lifetime(token: Biscuit) -> float:
+    """Seconds until the earliest expiration check of the token fails. Infinite if it has none.
+    """
+    lifetime = float('inf')
+    now = datetime.now(tz=timezone.utc)
+
+    for i in range(token.block_count()):
+        for match in EXPIRATION_CHECK.finditer(token.block_source(i)):
+            expiration = datetime.fromisoformat(
+                match.group(2).replace('Z', '+00:00'))
+            lifetime = min(lifetime, (expiration - now).total_seconds())
+
+    return lifetime
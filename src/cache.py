@@ -0,0 +1,71 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import threading
+import time
+
+
+class TTLCache:
+    """Thread safe, size bounded cache. Entries expire after a time to live and the least
+    recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expiry, value = entry
+
+            if expiry < time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """Store a value
+
+        Args:
+            key (Hashable): Cache key
+            value (Any): Value to store
+            ttl (float, optional): Seconds the entry is valid for. Defaults to the cache TTL.
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
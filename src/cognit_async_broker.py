@@ -0,0 +1,669 @@
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.channel import Channel
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+import time
+import uuid
+
+import opennebula
+import metrics
+import wire
+from admission import AdmissionController
+from object_store import ObjectStore
+from function_code import FunctionCodeStore
+from memoization import Memoization
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from cognit_models import ExecutionMode
+from cognit_broker import EXCHANGES, ERROR_DISPATCHER, ERROR_PUBLISH, ERROR_TIMEOUT, \
+    FUNCTION_CODE_MISSING, connection_parameters, prepare_execution_request, remaining_time, request_properties, \
+    result_message, result_outcome, result_queue, result_queue_arguments
+
+
+class AsyncBrokerClient:
+    """Broker client running on the event loop of the worker.
+
+    Execution results are consumed from a single reply queue owned by the client and routed to the
+    awaiting request by request ID, so waiting for a result holds a future instead of a thread.
+    Messages are published in confirm mode without waiting for each confirmation in turn.
+    """
+
+    def __init__(self, endpoint: str, logger: logging.Logger):
+        self.endpoint = endpoint
+        self.logger = logger
+
+        self.connection: AsyncioConnection = None
+        self.channel: Channel = None
+        self.queue: str = None
+        self.lock = asyncio.Lock()
+
+        self.pending: dict[str, asyncio.Future] = {}
+        self.rpcs: set[asyncio.Future] = set()
+
+        self.published = 0  # delivery tag of the last message published on the channel
+        self.confirms: dict[int, tuple[str, asyncio.Future]] = {}  # delivery tag -> message ID, confirmation
+        self.delivery_tags: dict[str, int] = {}  # message ID -> delivery tag, to fail returned messages
+        self.declared: set[str] = set()  # queues declared on the current connection
+
+    @property
+    def is_open(self) -> bool:
+        # the client is usable once its reply queue is consumed
+        return self.channel is not None and self.channel.is_open and self.queue is not None
+
+    async def connect(self):
+        # restart connection on demand
+        async with self.lock:
+            if self.is_open:
+                return
+
+            self.queue = None
+
+            loop = asyncio.get_running_loop()
+            opened = loop.create_future()
+
+            def on_open_error(connection, error):
+                if not opened.done():
+                    opened.set_exception(error if isinstance(
+                        error, BaseException) else pika.exceptions.AMQPConnectionError(error))
+
+            self.connection = AsyncioConnection(
+                connection_parameters(self.endpoint),
+                on_open_callback=opened.set_result,
+                on_open_error_callback=on_open_error,
+                on_close_callback=self._on_connection_closed,
+                custom_ioloop=loop)
+
+            try:
+                await opened
+            except Exception as e:
+                self.logger.error(f"Cannot connect to broker {self.endpoint}: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER)
+
+            self.logger.info(
+                f"Connection established to broker {self.endpoint}")
+
+            try:
+                await self._open_channel()
+            except Exception as e:
+                self.logger.error(f"Cannot set up the channel of broker {self.endpoint}: {e}")
+                self.queue = None
+                await self.close()
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER)
+
+    async def _open_channel(self):
+        """Open the channel of a new connection, declare the exchanges and consume the reply queue"""
+        self.channel = await self._rpc(self.connection.channel, callback_name='on_open_callback')
+        self.channel.add_on_close_callback(self._on_channel_closed)
+        self.channel.add_on_return_callback(self._on_return)
+
+        self.published = 0
+        self.declared = set()
+        await self._rpc(self.channel.confirm_delivery, ack_nack_callback=self._on_confirm)
+
+        self.logger.info("Ensuring required exchanges exist")
+
+        for type in EXCHANGES:
+            for exchange in EXCHANGES[type]:
+                await self._rpc(self.channel.exchange_declare, exchange=exchange, exchange_type=type)
+                self.logger.debug(
+                    f"Declared {type} exchange \"{exchange}\"")
+
+        frame = await self._rpc(self.channel.queue_declare, queue='', exclusive=True)
+
+        self.channel.basic_consume(
+            queue=frame.method.queue, on_message_callback=self._on_result, auto_ack=True)
+        self.queue = frame.method.queue
+
+        self.logger.info(
+            f"Dispatching execution results from queue {self.queue}")
+
+    async def close(self):
+        if self.connection is not None and not (self.connection.is_closed or self.connection.is_closing):
+            self.connection.close()
+
+    async def send_message(self, message: dict, routing_key: str, queue: str = '', exchange: str = '',
+                           properties: pika.BasicProperties = None):
+        await self.send_messages([message], routing_key=routing_key, queue=queue,
+                                 exchange=exchange, properties=[properties])
+
+    async def send_messages(self, messages: list[dict], routing_key: str, queue: str = '', exchange: str = '',
+                            properties: list[pika.BasicProperties] = None):
+        """Publish several messages with the same routing key and wait until the broker confirms all of them.
+        Each message is confirmed once it has been routed to a queue.
+
+        Raises:
+            HTTPException: 503 if the broker did not accept a message
+        """
+        await self.connect()
+
+        # default exchange uses queues based on routing keys
+        if exchange == '':
+            queue = routing_key
+
+        if properties is None:
+            properties = [None] * len(messages)
+
+        # returned messages are matched to their confirmation by message ID
+        properties = [message_properties or pika.BasicProperties() for message_properties in properties]
+
+        for message_properties in properties:
+            if message_properties.message_id is None:
+                message_properties.message_id = str(uuid.uuid4())
+
+        self.logger.info(f"Sending {len(messages)} message(s) to queue {queue}")
+
+        unroutable = await self._publish(messages, queue, routing_key, exchange, properties)
+
+        if unroutable:
+            # the queue was deleted since it was declared
+            self.declared.discard(queue)
+
+            unroutable = await self._publish([messages[index] for index in unroutable], queue, routing_key,
+                                             exchange, [properties[index] for index in unroutable])
+
+        if unroutable:
+            self.logger.error(f"{len(unroutable)} message(s) to queue {queue} could not be routed")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_PUBLISH)
+
+        self.logger.info("Message queued")
+
+    async def _publish(self, messages: list[dict], queue: str, routing_key: str, exchange: str,
+                       properties: list[pika.BasicProperties]) -> list[int]:
+        """Publish messages and wait for their confirmation
+
+        Returns:
+            list[int]: Indexes of the messages returned by the broker as unroutable
+        """
+        if queue not in self.declared:
+            await self._rpc(self.channel.queue_declare, queue=queue)
+            self.declared.add(queue)
+
+        loop = asyncio.get_running_loop()
+        confirms = []
+
+        for message, message_properties in zip(messages, properties):
+            self.logger.debug(message)
+
+            body = wire.encode(message, message_properties.content_type)
+
+            self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                       properties=message_properties, mandatory=True)
+
+            self.published += 1
+            confirm = loop.create_future()
+            self.confirms[self.published] = (message_properties.message_id, confirm)
+            self.delivery_tags[message_properties.message_id] = self.published
+            confirms.append(confirm)
+
+        results = await asyncio.gather(*confirms, return_exceptions=True)
+        unroutable = [index for index, result in enumerate(results)
+                      if isinstance(result, pika.exceptions.UnroutableError)]
+
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, pika.exceptions.UnroutableError):
+                raise result
+
+        return unroutable
+
+    async def queue_depth(self, queue: str) -> int:
+        """Number of messages ready in a queue, 0 if it does not exist yet"""
+        await self.connect()
+
+        # a failed passive declaration closes the channel, keep it away from the consuming one
+        channel = await self._rpc(self.connection.channel, callback_name='on_open_callback')
+        declared = self._rpc(channel.queue_declare, queue=queue, passive=True)
+
+        def on_close(channel: Channel, reason: Exception):
+            if not declared.done():
+                declared.set_exception(reason)
+
+        channel.add_on_close_callback(on_close)
+
+        try:
+            frame = await declared
+        except pika.exceptions.ChannelClosedByBroker as e:
+            if e.reply_code == 404:
+                return 0
+            raise
+
+        channel.close()
+
+        return frame.method.message_count
+
+    async def register(self, request_id: str) -> asyncio.Future:
+        """Bind the request ID to the reply queue and return the future that will hold its result.
+        Must be awaited before the execution request is published.
+        """
+        await self.connect()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        try:
+            await self._rpc(self.channel.queue_bind, queue=self.queue, exchange='results', routing_key=request_id)
+        except Exception:
+            self.pending.pop(request_id, None)
+            raise
+
+        return future
+
+    async def declare_result_queue(self, request_id: str, owner: str):
+        """Declare the queue keeping the result of an asynchronous execution"""
+        await self.connect()
+
+        queue = result_queue(request_id, owner)
+
+        await self._rpc(self.channel.queue_declare, queue=queue, arguments=result_queue_arguments())
+        await self._rpc(self.channel.queue_bind, queue=queue, exchange='results', routing_key=request_id)
+
+    def release(self, request_id: str):
+        """Stop routing results of a request to this client"""
+        self.pending.pop(request_id, None)
+
+        if self.is_open:
+            self.channel.queue_unbind(
+                queue=self.queue, exchange='results', routing_key=request_id)
+
+    def _rpc(self, method: callable, callback_name: str = 'callback', **kwargs) -> asyncio.Future:
+        """Call an asynchronous pika method and return a future resolved with its reply frame"""
+        future = asyncio.get_running_loop().create_future()
+
+        def callback(frame):
+            if not future.done():
+                future.set_result(frame)
+
+        self.rpcs.add(future)
+        future.add_done_callback(self.rpcs.discard)
+
+        method(**{callback_name: callback}, **kwargs)
+
+        return future
+
+    def _on_result(self, channel: Channel, method, properties: pika.BasicProperties, body):
+        request_id = properties.correlation_id or method.routing_key
+        future = self.pending.get(request_id)
+
+        if future is None or future.done():
+            self.logger.debug(f"Discarding result of unknown request {request_id}")
+            return
+
+        self.logger.info(f"Received message {request_id}")
+
+        try:
+            future.set_result(wire.decode(body, properties.content_type))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+
+        if method.multiple:
+            delivery_tags = [tag for tag in self.confirms if tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+
+        for tag in delivery_tags:
+            message_id, future = self.confirms.pop(tag, (None, None))
+            self.delivery_tags.pop(message_id, None)
+
+            if future is None or future.done():
+                continue
+
+            if acked:
+                future.set_result(None)
+            else:
+                self.logger.error(f"Message {tag} was rejected by the broker")
+                future.set_exception(HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_PUBLISH))
+
+    def _on_return(self, channel: Channel, method, properties: pika.BasicProperties, body):
+        # the queue was deleted since it was declared, declare it again on the next publish
+        self.logger.warning(f"Message to queue {method.routing_key} could not be routed: {method.reply_text}")
+        self.declared.discard(method.routing_key)
+
+        # the broker returns a message before confirming it
+        tag = self.delivery_tags.pop(properties.message_id, None)
+        _, future = self.confirms.pop(tag, (None, None))
+
+        if future is not None and not future.done():
+            future.set_exception(pika.exceptions.UnroutableError([]))
+
+    def _on_channel_closed(self, channel: Channel, reason: Exception):
+        if channel is not self.channel:
+            return  # channel of a replaced connection
+
+        self.logger.error(f"Broker channel closed: {reason}")
+        self._fail_pending()
+
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+    def _on_connection_closed(self, connection: AsyncioConnection, reason: Exception):
+        if connection is not self.connection:
+            return  # late close of a replaced connection, its pending requests already failed
+
+        self.logger.info(f"Broker connection closed: {reason}")
+        self.channel = None
+        self._fail_pending()
+
+    def _fail_pending(self):
+        # the reply queue and its bindings are gone, results of pending requests are lost
+        pending = list(self.pending.values()) + list(self.rpcs) + \
+            [future for _, future in self.confirms.values()]
+        self.pending = {}
+        self.confirms = {}
+        self.delivery_tags = {}
+
+        for future in pending:
+            if not future.done():
+                future.set_exception(HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER))
+
+
+class AsyncExecutioner():
+
+    def __init__(self, broker_client: AsyncBrokerClient, one_client: opennebula.OpenNebulaClient,
+                 deadline: float = None, admission: AdmissionController = None,
+                 object_store: ObjectStore = None, function_code: FunctionCodeStore = None,
+                 result_cache: ResultCache = None, flights: SingleFlight = None):
+        """
+        Args:
+            deadline (float, optional): time.monotonic() value after which synchronous executions
+                are abandoned. Defaults to waiting for them forever.
+            admission (AdmissionController, optional): Rejects executions of saturated flavours.
+                Defaults to accepting every execution.
+            object_store (ObjectStore, optional): Holds long parameters and results instead of the
+                broker. Defaults to sending everything through the broker.
+            function_code (FunctionCodeStore, optional): Serves the code of synchronous executions
+                sent by hash. Defaults to sending the code inline.
+            result_cache (ResultCache, optional): Results of deterministic functions reused by
+                synchronous executions opting into it. Defaults to executing every request.
+            flights (SingleFlight, optional): Executions in flight, joined by identical synchronous
+                executions opting into the result cache. Defaults to executing every request.
+        """
+        self.one = one_client
+        self.broker = broker_client
+        self.deadline = deadline
+        self.admission = admission
+        self.object_store = object_store
+        self.function_code = function_code
+        self.results: dict[str, asyncio.Future] = {}
+        self.flavours: dict[str, str] = {}  # flavour of executions still awaited
+        self.published: dict[str, float] = {}  # time.perf_counter() of their publication
+        self.inline: dict[str, dict] = {}  # requests sent by hash, to send again with their code
+        self.memo = Memoization(result_cache, flights)
+
+    async def request_execution(self, request: dict, flavour: str, mode: str) -> str:
+        """Queue an execution request to be processed by an SR instance
+
+        Args:
+            request (dict): Execution request payload as expected by the SR API
+            flavour (str): Flavour Queue the SR is responsible for processing requests from
+            mode (str): Execution mode of the function, sync or async
+
+        Returns:
+            str: Request ID of the requested execution
+        """
+        return (await self.request_executions([request], flavour, mode))[0]
+
+    async def request_executions(self, requests: list[dict], flavour: str, mode: str) -> list[str]:
+        """Queue several execution requests to the same flavour in one pass
+
+        Returns:
+            list[str]: Request IDs of the requested executions, in the same order
+        """
+        # Tag offload requests with an ID in order to wait for results
+        request_ids = [str(uuid.uuid4()) for _ in requests]
+        execution_requests = [{"request_id": request_id,
+                               "mode": mode,
+                               "payload": request}
+                              for request_id, request in zip(request_ids, requests)]
+
+        self.broker.logger.info("Requesting execution")
+        self.broker.logger.debug(execution_requests)
+
+        # asynchronous executions are not awaited
+        awaited = mode != ExecutionMode.ASYNC
+
+        if self.admission is not None:
+            depth = self.admission.queue_depth(flavour, len(requests))
+
+            if depth is None:
+                depth = await self.broker.queue_depth(flavour)
+                self.admission.update_queue_depth(flavour, depth)
+
+            self.admission.admit(flavour, len(requests), depth, in_flight=awaited)
+
+        if awaited:
+            self.flavours.update((request_id, flavour) for request_id in request_ids)
+
+            # only awaited executions can be sent again when the SR lacks their code
+            if self.function_code is not None:
+                self.inline.update(zip(request_ids, execution_requests))
+                # the code may be uploaded to the object store
+                execution_requests = await run_in_threadpool(
+                    lambda: [self.function_code.by_hash(execution_request)
+                             for execution_request in execution_requests])
+
+        try:
+            with metrics.EXECUTION_REQUEST.time(flavour=flavour, mode=mode):
+                await self._request_executions(request_ids, execution_requests, flavour, mode)
+        except Exception:
+            self.forget_executions(request_ids)
+            raise
+
+        self.published.update(dict.fromkeys(request_ids, time.perf_counter()))
+
+        return request_ids
+
+    async def _request_executions(self, request_ids: list[str], execution_requests: list[dict], flavour: str,
+                                  mode: str):
+        if self.object_store is not None:
+            # uploads are blocking
+            await run_in_threadpool(self.object_store.offload, execution_requests)
+
+        if mode == ExecutionMode.ASYNC:
+            # Results wait in the broker until the client asks for them, from any worker
+            await asyncio.gather(*[self.broker.declare_result_queue(request_id, self.one.username)
+                                   for request_id in request_ids])
+
+            properties = [request_properties(request_id, flavour, deadline=self.deadline)
+                          for request_id in request_ids]
+
+            await self.broker.send_messages(
+                messages=execution_requests, routing_key=flavour, properties=properties)
+
+            return
+
+        try:
+            # Route the results to the reply queue before they can be published
+            futures = await asyncio.gather(*[self.broker.register(request_id) for request_id in request_ids])
+            self.results.update(zip(request_ids, futures))
+
+            properties = [request_properties(request_id, flavour, deadline=self.deadline,
+                                             reply_to=self.broker.queue)
+                          for request_id in request_ids]
+
+            await self.broker.send_messages(
+                messages=execution_requests, routing_key=flavour, properties=properties)
+        except Exception:
+            for request_id in request_ids:
+                self.broker.release(request_id)
+                self.results.pop(request_id, None)
+            raise
+
+    async def await_execution(self, request_id: str) -> dict:
+        """Wait for the result of an execution until the deadline
+
+        Raises:
+            HTTPException: 504 if the deadline passes before the result arrives
+        """
+        if request_id in self.memo.cached:
+            return self.memo.cached.pop(request_id)
+
+        if request_id in self.memo.following:
+            return await self._follow(request_id)
+
+        # popped before waiting, the executions forgotten with their key are the abandoned ones
+        key = self.memo.result_keys.pop(request_id, None)
+
+        try:
+            result = await self._await_published(request_id)
+        except BaseException as e:
+            self.memo.land(key, error=e)
+            raise
+
+        self.memo.land(key, result)
+
+        return result
+
+    async def _await_published(self, request_id: str) -> dict:
+        with metrics.EXECUTION_WAIT.time(start=self.published.get(request_id),
+                                         flavour=self.flavours.get(request_id)) as timer:
+            try:
+                result = await self._receive_result(request_id)
+
+                if result["code"] == FUNCTION_CODE_MISSING and request_id in self.inline:
+                    self.broker.logger.info(f"Function code of {request_id} not available, sending it inline")
+                    await self._request_executions([request_id], [self.inline.pop(request_id)],
+                                                   self.flavours[request_id], ExecutionMode.SYNC)
+                    result = await self._receive_result(request_id)
+            finally:
+                self.forget_executions([request_id])
+
+            timer.label(outcome=result_outcome(result))
+
+        self.broker.logger.info("Execution result received")
+        self.broker.logger.debug(result)
+
+        return result
+
+    async def _follow(self, request_id: str) -> dict:
+        """Wait for the result of the identical execution in flight joined by an execution. If that one
+        ends without result, join the next one or run the execution
+        """
+        flight, key, execution_request, flavour = self.memo.following.pop(request_id)
+
+        while flight is not None:
+            # shielded, the flight is shared with other executions and must not be cancelled by this one
+            try:
+                result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)),
+                                                timeout=remaining_time(self.deadline))
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_TIMEOUT)
+
+            if result is not None:
+                return result
+
+            flight = self.memo.rejoin(key)
+
+        return await self.await_execution((await self._request_memoized([key], [execution_request], flavour))[0])
+
+    async def _request_memoized(self, keys: list[tuple[str, str]], execution_requests: list[dict],
+                                flavour: str) -> list[str]:
+        """Publish executions whose results are cached and shared, releasing the identical executions
+        joined to them if they could not be published
+        """
+        try:
+            request_ids = await self.request_executions(execution_requests, flavour, mode=ExecutionMode.SYNC)
+        except Exception as e:
+            for key in keys:
+                self.memo.land(key, error=e)
+            raise
+
+        self.memo.published(keys, request_ids)
+
+        return request_ids
+
+    async def _receive_result(self, request_id: str) -> dict:
+        try:
+            return await asyncio.wait_for(self.results.pop(request_id), remaining_time(self.deadline))
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_TIMEOUT)
+        finally:
+            self.broker.release(request_id)
+
+    def forget_executions(self, request_ids: list[str]):
+        """Stop accounting executions as awaited"""
+        for request_id in request_ids:
+            flavour = self.flavours.pop(request_id, None)
+            self.published.pop(request_id, None)
+            self.inline.pop(request_id, None)
+            self.memo.forget(request_id)
+
+            if flavour is not None and self.admission is not None:
+                self.admission.release(flavour)
+
+    async def submit_function(self, function_id: int, app_req_id: int, parameters: list[str], mode: str) -> str:
+        """Read the function and its requirements and queue its execution
+
+        Returns:
+            str: Request ID of the requested execution
+        """
+        return (await self.submit_batch(function_id, app_req_id, [parameters], mode))[0]
+
+    async def submit_batch(self, function_id: int, app_req_id: int, parameter_sets: list[list[str]],
+                           mode: str, memoize: bool = False) -> list[str]:
+        """Read the function and its requirements once and queue one execution per set of parameters
+
+        Args:
+            memoize (bool, optional): Reuse cached results of synchronous executions even if the
+                requirements do not declare the function deterministic. Defaults to False.
+
+        Returns:
+            list[str]: Request IDs of the requested executions, in the same order
+        """
+        # XMLRPC calls to oned are blocking
+        function = await run_in_threadpool(self.one.get_function, function_id)
+        requirement = await run_in_threadpool(self.one.get_app_requirement, app_req_id)
+
+        execution_requests = [prepare_execution_request(function, parameters, app_req_id)
+                              for parameters in parameter_sets]
+
+        if not self.memo.applies(mode, memoize, requirement):
+            # Publish execution request to an exchange. Use flavour as routing key.
+            return await self.request_executions(
+                execution_requests, requirement["FLAVOUR"], mode=mode)
+
+        # only the executions without cached result nor identical execution in flight are published
+        request_ids, keys, missing = self.memo.plan(
+            function, parameter_sets, execution_requests, requirement["FLAVOUR"])
+
+        if missing:
+            published = await self._request_memoized([keys[index] for index in missing],
+                                                     [execution_requests[index] for index in missing],
+                                                     requirement["FLAVOUR"])
+
+            for index, request_id in zip(missing, published):
+                request_ids[index] = request_id
+
+        return request_ids
+
+    async def collect_result(self, request_id: str) -> dict:
+        """Wait for the result of a submitted execution
+
+        Raises:
+            HTTPException: With the code of the execution if it was not successful
+        """
+        return result_message(await self.await_execution(request_id))
+
+    async def collect_results(self, request_ids: list[str]) -> list[dict]:
+        """Wait for the results of several submitted executions. Unsuccessful executions do not raise,
+        every result keeps the code and message returned by the SR.
+        """
+        return await asyncio.gather(*[self.await_execution(request_id) for request_id in request_ids])
+
+    async def execute_function(self, function_id: int, app_req_id: int, parameters: list[str], mode: str) -> dict:
+        execution_id = await self.submit_function(
+            function_id, app_req_id, parameters, mode)
+
+        return await self.collect_result(execution_id)
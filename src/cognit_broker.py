@@ -2,6 +2,15 @@
 import pika
 from pika.adapters.blocking_connection import BlockingChannel
 from urllib.parse import urlparse
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Iterator
+import collections
+import functools
+import hashlib
+import queue
+import threading
+import time
 import ssl
 import json
 import logging
@@ -9,11 +18,32 @@ import uuid
 from fastapi import HTTPException, status
 
 import opennebula
+import metrics
+import wire
+from admission import AdmissionController
+from object_store import ObjectStore
+from function_code import FunctionCodeStore
+from memoization import Memoization
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from cognit_models import ExecutionMode
 
 EXCHANGES = {  # list of exchanges to create when connecting to the broker
-    'direct': ['results']
+    'direct': ['results'],
+    'fanout': ['device_metrics']
 }
 
+POOL_TIMEOUT = 30  # seconds to wait for a free broker connection
+RECONNECT_INTERVAL = 5  # seconds between reconnection attempts of the result dispatcher
+RESULT_TTL = 3600  # seconds results of asynchronous executions are kept by the broker
+WIRE_FORMATS: dict[str, str] = {}  # content type of the execution requests of each flavour, JSON for the rest
+ERROR_POOL = "No broker connection available"
+ERROR_DISPATCHER = "Execution results are not being received from the broker"
+ERROR_EXECUTION_NOT_FOUND = "Execution not found"
+ERROR_TIMEOUT = "Function execution timed out"
+ERROR_PUBLISH = "Execution request was not accepted by the broker"
+FUNCTION_CODE_MISSING = status.HTTP_412_PRECONDITION_FAILED  # result of SRs lacking the code sent by hash
+
 
 class BrokerClient:
     def __init__(self, endpoint: str, logger: logging.Logger):
@@ -21,26 +51,19 @@ class BrokerClient:
         self.logger = logger
         self.connection = None
 
+        self.channel: BlockingChannel = None  # confirm mode channel used to publish
+        self.declared: set[str] = set()  # queues declared on the current connection
+
         self.connect()
 
     def connect(self) -> pika.BlockingConnection:
         # restart connection on demand
         if self.connection is None or self.connection.is_closed:
-            endpoint = urlparse(self.endpoint)
-
-            connection_parameters = pika.ConnectionParameters(
-                host=endpoint.hostname, port=endpoint.port)
-
-            if endpoint.scheme == 'ssl':
-                # trust ssl certificates
-                ssl_context = ssl.create_default_context()
-                ssl_context.check_hostname = False
-                ssl_context.verify_mode = ssl.CERT_NONE
-
-                connection_parameters.ssl_options = pika.SSLOptions(
-                    context=ssl_context)
+            self.connection = pika.BlockingConnection(
+                connection_parameters(self.endpoint))
 
-            self.connection = pika.BlockingConnection(connection_parameters)
+            self.channel = None
+            self.declared = set()
 
             self.logger.info(
                 f"Connection established to broker {self.endpoint}")
@@ -57,30 +80,250 @@ class BrokerClient:
                     self.logger.debug(
                         f"Declared {type} exchange \"{exchange}\"")
 
-            channel.close
+            channel.close()
 
         return self.connection
 
-    def send_message(self, message: dict, routing_key: str, queue: str = '', exchange: str = '') -> BlockingChannel:
-        self.connect()
-        channel = self.connection.channel()
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except pika.exceptions.AMQPError as e:
+                self.logger.debug(f"Error closing broker connection: {e}")
+
+        self.connection = None
+
+    def is_healthy(self) -> bool:
+        """Check whether the connection is still usable. Pending I/O such as heartbeats is processed,
+        which surfaces connections dropped by the broker while they were idle.
+        """
+        if self.connection is None or self.connection.is_closed:
+            return False
+
+        try:
+            self.connection.process_data_events(time_limit=0)
+        except (pika.exceptions.AMQPError, OSError) as e:
+            self.logger.warning(f"Broker connection is not healthy: {e}")
+            return False
+
+        return self.connection.is_open
+
+    def send_message(self, message: dict, routing_key: str, queue: str = '', exchange: str = '',
+                     properties: pika.BasicProperties = None):
+        self.send_messages([message], routing_key=routing_key, queue=queue,
+                           exchange=exchange, properties=[properties])
+
+    def send_messages(self, messages: list[dict], routing_key: str, queue: str = '', exchange: str = '',
+                      properties: list[pika.BasicProperties] = None):
+        """Publish several messages with the same routing key. Each message is confirmed by the broker
+        once it has been routed to a queue.
+
+        Raises:
+            HTTPException: 503 if the broker did not accept a message
+        """
+        channel = self.publish_channel()
 
         # default exchange uses queues based on routing keys
         if exchange == '':
             queue = routing_key
 
-        channel.queue_declare(queue=queue)
+        self.declare_queue(queue)
 
-        self.logger.info(f"Sending message to queue {queue}")
-        self.logger.debug(message)
+        if properties is None:
+            properties = [None] * len(messages)
 
-        channel.basic_publish(
-            exchange=exchange, routing_key=routing_key, body=json.dumps(message))
+        self.logger.info(f"Sending {len(messages)} message(s) to queue {queue}")
+
+        for message, message_properties in zip(messages, properties):
+            self.logger.debug(message)
+
+            body = wire.encode(message, message_properties.content_type if message_properties else None)
+
+            try:
+                try:
+                    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                          properties=message_properties, mandatory=True)
+                except pika.exceptions.UnroutableError:
+                    # the queue was deleted since it was declared
+                    self.declared.discard(queue)
+                    self.declare_queue(queue)
+
+                    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                          properties=message_properties, mandatory=True)
+            except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+                self.logger.error(f"Message to queue {queue} was not confirmed: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_PUBLISH)
 
         self.logger.info("Message queued")
-        channel.close()
 
-    def receive_message(self, routing_key: str, queue: str) -> str:
+    def publish(self, exchange: str, message: dict | list, routing_key: str = ''):
+        """Publish a message to an exchange, delivered to the queues bound to it if any"""
+        self.publish_channel().basic_publish(
+            exchange=exchange, routing_key=routing_key, body=json.dumps(message))
+
+    def publish_channel(self) -> BlockingChannel:
+        """Long-lived channel in confirm mode messages are published on"""
+        self.connect()
+
+        if self.channel is None or not self.channel.is_open:
+            self.channel = self.connection.channel()
+            self.channel.confirm_delivery()
+
+        return self.channel
+
+    def declare_queue(self, queue: str):
+        """Declare a queue unless already declared on the current connection"""
+        if queue in self.declared:
+            return
+
+        self.publish_channel().queue_declare(queue=queue)
+        self.declared.add(queue)
+
+    def queue_depth(self, queue: str) -> int:
+        """Number of messages ready in a queue, 0 if it does not exist yet"""
+        self.connect()
+        channel = self.connection.channel()
+
+        try:
+            return channel.queue_declare(queue=queue, passive=True).method.message_count
+        except pika.exceptions.ChannelClosedByBroker as e:
+            if e.reply_code == 404:
+                return 0
+            raise
+        finally:
+            if channel.is_open:
+                channel.close()
+
+    def peek_message(self, queue: str, timeout: float = 0) -> dict | None:
+        """Read the first message of a queue leaving it in place, waiting up to timeout seconds for one
+
+        Raises:
+            HTTPException: 404 if the queue does not exist
+
+        Returns:
+            dict | None: The message, None if the queue stayed empty
+        """
+        self.connect()
+        channel = self.connection.channel()
+
+        body = None
+
+        try:
+            try:
+                channel.queue_declare(queue=queue, passive=True)
+            except pika.exceptions.ChannelClosedByBroker as e:
+                if e.reply_code == 404:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND, detail=ERROR_EXECUTION_NOT_FOUND)
+                raise
+
+            if timeout > 0:
+                for method, properties, body in channel.consume(queue=queue, inactivity_timeout=timeout):
+                    break
+            else:
+                method, properties, body = channel.basic_get(queue=queue)
+        finally:
+            # the message is not acknowledged, closing the channel returns it to the queue
+            if channel.is_open:
+                channel.close()
+
+        if body is None:
+            return None
+
+        return wire.decode(body, properties.content_type)
+
+    def stream_messages(self, queues: list[str], timeout: float,
+                        idle_interval: float) -> Iterator[tuple[str, dict | None] | None]:
+        """Read the first message of several queues as they become available, leaving them in place.
+        Every queue is consumed on the same channel, each message is returned to its queue as soon as
+        it is read, so it can still be read by others while the stream goes on.
+
+        Args:
+            queues (list[str]): Queues to read from
+            timeout (float): Seconds to wait for the messages
+            idle_interval (float): Seconds without messages after which None is yielded
+
+        Yields:
+            tuple[str, dict | None] | None: Queue and its message, or None if the queue does not exist.
+            None alone when no message arrived within the idle interval.
+        """
+        self.connect()
+
+        received: collections.deque[tuple[pika.spec.Basic.Deliver, pika.BasicProperties, bytes]] = \
+            collections.deque()
+        consumers: dict[str, str] = {}
+
+        def callback(channel: BlockingChannel, method, properties, body):
+            received.append((method, properties, body))
+
+        channel = None
+        existing = []
+
+        try:
+            for queue in queues:
+                # a failed passive declaration closes the channel
+                if channel is None or not channel.is_open:
+                    channel = self.connection.channel()
+
+                try:
+                    channel.queue_declare(queue=queue, passive=True)
+                    existing.append(queue)
+                except pika.exceptions.ChannelClosedByBroker as e:
+                    if e.reply_code != 404:
+                        raise
+
+                    yield queue, None
+
+            if channel is None or not channel.is_open:
+                channel = self.connection.channel()
+
+            for queue in existing:
+                consumer_tag = channel.basic_consume(queue=queue, on_message_callback=callback)
+                consumers[consumer_tag] = queue
+
+            self.logger.info(f'Streaming messages from {len(consumers)} queue(s)')
+
+            deadline = time.monotonic() + timeout
+
+            while consumers:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self.connection.process_data_events(
+                    time_limit=min(idle_interval, remaining))
+
+                if not received:
+                    yield None
+
+                while received:
+                    method, properties, body = received.popleft()
+
+                    if method.consumer_tag in consumers:
+                        channel.basic_cancel(method.consumer_tag)
+
+                    # the message is not acknowledged, return it to the queue for polls of the same result
+                    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+                    if method.consumer_tag in consumers:
+                        yield consumers.pop(method.consumer_tag), wire.decode(body, properties.content_type)
+        finally:
+            if channel is not None and channel.is_open:
+                channel.close()
+
+    def receive_message(self, routing_key: str, queue: str, timeout: float = None) -> dict | None:
+        """Wait for the message of a request
+
+        Args:
+            routing_key (str): Request ID the message belongs to
+            queue (str): Queue the message is delivered to
+            timeout (float, optional): Seconds to wait for the message. Defaults to waiting forever.
+
+        Returns:
+            dict | None: The message, None if it did not arrive in time
+        """
         self.connect()
         channel = self.connection.channel()
 
@@ -88,7 +331,7 @@ class BrokerClient:
 
         def callback(channel: BlockingChannel, method, properties, body):
             nonlocal result
-            result = json.loads(body)
+            result = wire.decode(body, properties.content_type)
 
             self.logger.info(f'Received message {routing_key}')
             self.logger.debug(result)
@@ -99,16 +342,307 @@ class BrokerClient:
             queue=queue, on_message_callback=callback, auto_ack=True)
 
         self.logger.info(f'Waiting for messages related to {routing_key}')
-        channel.start_consuming()
+
+        timer = None
+        if timeout is not None:
+            timer = self.connection.call_later(timeout, channel.stop_consuming)
+
+        try:
+            channel.start_consuming()
+        finally:
+            if timer is not None:
+                self.connection.remove_timeout(timer)
+
+            if channel.is_open:
+                channel.close()
 
         return result
 
 
+class BrokerPool:
+    """Bounded, thread safe pool of broker connections shared by the application.
+    A BlockingConnection must only be used by one thread at a time, so each client is
+    borrowed exclusively for the duration of an execution.
+    """
+
+    def __init__(self, endpoint: str, logger: logging.Logger, size: int, timeout: float = POOL_TIMEOUT):
+        self.endpoint = endpoint
+        self.logger = logger
+        self.size = size
+        self.timeout = timeout
+
+        self.idle: queue.LifoQueue[BrokerClient] = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def borrow(self) -> Iterator[BrokerClient]:
+        """Lend a connected broker client. It is returned to the pool when the context exits,
+        unless the connection failed while in use.
+
+        Raises:
+            HTTPException: 503 if no connection becomes available within the pool timeout
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            self.logger.error(
+                f"Broker connection pool exhausted ({self.size} connections)")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_POOL)
+
+        client = None
+
+        try:
+            client = self._checkout()
+            yield client
+        except (pika.exceptions.AMQPError, OSError):
+            # connection state is unknown after a transport failure, do not reuse it
+            if client is not None:
+                client.close()
+                client = None
+            raise
+        finally:
+            if client is not None:
+                self.idle.put(client)
+
+            self.slots.release()
+
+    def check(self):
+        """Ensure the broker is reachable, connecting an idle client if needed. A pool with every
+        connection in use is considered reachable without waiting for one.
+
+        Raises:
+            AMQPError: If the broker cannot be reached
+        """
+        if not self.slots.acquire(blocking=False):
+            return
+
+        self.slots.release()
+
+        with self.borrow():
+            pass
+
+    def _checkout(self) -> BrokerClient:
+        try:
+            client = self.idle.get_nowait()
+        except queue.Empty:
+            self.logger.debug("Opening new pooled broker connection")
+            return BrokerClient(endpoint=self.endpoint, logger=self.logger)
+
+        if not client.is_healthy():
+            # reconnect in place, required exchanges are ensured again by connect()
+            client.close()
+            client.connect()
+
+        return client
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ResultDispatcher:
+    """Consumes every execution result addressed to this worker from a single long-lived reply queue
+    and routes it to the waiting request by its request ID.
+
+    The dispatcher owns a dedicated connection used only from its own thread. Request threads interact
+    with it through add_callback_threadsafe, the only thread safe method of a BlockingConnection.
+    Results published to the results exchange with the request ID as routing key, as done by the SR
+    broker client, reach the reply queue through a per request binding. Requests also carry the reply
+    queue and request ID as reply_to and correlation_id properties for clients that answer directly.
+    """
+
+    def __init__(self, endpoint: str, logger: logging.Logger):
+        self.endpoint = endpoint
+        self.logger = logger
+        self.client: BrokerClient = None
+
+        self.queue: str = None
+        self.channel: BlockingChannel = None
+        self.pending: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopping = False
+        self.thread: threading.Thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name="result-dispatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+
+        if self.ready.is_set():
+            self.client.connection.add_callback_threadsafe(
+                lambda: self.channel.stop_consuming())
+
+        if self.thread is not None:
+            self.thread.join(timeout=RECONNECT_INTERVAL)
+
+    def register(self, request_id: str) -> Future:
+        """Bind the request ID to the reply queue and return the future that will hold its result.
+        Must be called before the execution request is published.
+
+        Args:
+            request_id (str): ID the execution result will be routed with
+
+        Returns:
+            Future: Resolved with the execution result dictionary
+        """
+        if not self.ready.wait(timeout=POOL_TIMEOUT):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER)
+
+        future = Future()
+
+        with self.lock:
+            self.pending[request_id] = future
+
+        bound = Future()
+
+        def bind():
+            try:
+                self.channel.queue_bind(
+                    exchange='results', queue=self.queue, routing_key=request_id)
+                bound.set_result(True)
+            except Exception as e:
+                bound.set_exception(e)
+
+        try:
+            self.client.connection.add_callback_threadsafe(bind)
+            bound.result(timeout=POOL_TIMEOUT)
+        except Exception as e:
+            self.release(request_id)
+            self.logger.error(f"Could not bind results of {request_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER)
+
+        return future
+
+    def release(self, request_id: str):
+        """Stop routing results of a request to this worker"""
+        with self.lock:
+            self.pending.pop(request_id, None)
+
+        def unbind():
+            if self.channel.is_open:
+                self.channel.queue_unbind(
+                    exchange='results', queue=self.queue, routing_key=request_id)
+
+        if not self.ready.is_set():
+            return  # the binding disappeared with the connection
+
+        try:
+            self.client.connection.add_callback_threadsafe(unbind)
+        except Exception as e:
+            # the binding disappeared with the connection
+            self.logger.debug(f"Could not unbind results of {request_id}: {e}")
+
+    @property
+    def reply_to(self) -> str:
+        return self.queue
+
+    def _run(self):
+        while not self.stopping:
+            try:
+                if self.client is None:
+                    self.client = BrokerClient(
+                        endpoint=self.endpoint, logger=self.logger)
+
+                connection = self.client.connect()
+
+                self.channel = connection.channel()
+                self.queue = self.channel.queue_declare(
+                    queue='', exclusive=True).method.queue
+                self.channel.basic_consume(
+                    queue=self.queue, on_message_callback=self._on_result, auto_ack=True)
+
+                self.logger.info(
+                    f"Dispatching execution results from queue {self.queue}")
+                self.ready.set()
+
+                self.channel.start_consuming()
+            except Exception as e:
+                self.logger.error(f"Result dispatcher lost the broker connection: {e}")
+            finally:
+                self.ready.clear()
+
+            # the reply queue and its bindings are gone, results of pending requests are lost
+            self._fail_pending()
+
+            if self.client is not None:
+                self.client.close()
+
+            if not self.stopping:
+                time.sleep(RECONNECT_INTERVAL)
+
+    def _on_result(self, channel: BlockingChannel, method, properties: pika.BasicProperties, body):
+        request_id = properties.correlation_id or method.routing_key
+
+        with self.lock:
+            future = self.pending.get(request_id)
+
+        if future is None:
+            self.logger.debug(f"Discarding result of unknown request {request_id}")
+            return
+
+        self.logger.info(f"Received message {request_id}")
+
+        try:
+            future.set_result(wire.decode(body, properties.content_type))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _fail_pending(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_DISPATCHER))
+
+
 class Executioner():
 
-    def __init__(self, broker_client: BrokerClient, one_client: opennebula.OpenNebulaClient):
+    def __init__(self, broker_client: BrokerClient, one_client: opennebula.OpenNebulaClient,
+                 dispatcher: ResultDispatcher = None, deadline: float = None,
+                 admission: AdmissionController = None, object_store: ObjectStore = None,
+                 function_code: FunctionCodeStore = None, broker_pool: BrokerPool = None,
+                 result_cache: ResultCache = None, flights: SingleFlight = None):
+        """
+        Args:
+            deadline (float, optional): time.monotonic() value after which synchronous executions
+                are abandoned. Defaults to waiting for them forever.
+            admission (AdmissionController, optional): Rejects executions of saturated flavours.
+                Defaults to accepting every execution.
+            object_store (ObjectStore, optional): Holds long parameters and results instead of the
+                broker. Defaults to sending everything through the broker.
+            function_code (FunctionCodeStore, optional): Serves the code of synchronous executions
+                sent by hash. Defaults to sending the code inline.
+            result_cache (ResultCache, optional): Results of deterministic functions reused by
+                synchronous executions opting into it. Defaults to executing every request.
+            flights (SingleFlight, optional): Executions in flight, joined by identical synchronous
+                executions opting into the result cache. Defaults to executing every request.
+            broker_pool (BrokerPool, optional): Pool the broker client was borrowed from, to send
+                executions again once it has been returned while waiting on the dispatcher
+        """
         self.one = one_client
         self.broker = broker_client
+        self.broker_pool = broker_pool
+        self.dispatcher = dispatcher
+        self.deadline = deadline
+        self.admission = admission
+        self.object_store = object_store
+        self.function_code = function_code
+        self.results: dict[str, Future] = {}
+        self.flavours: dict[str, str] = {}  # flavour of executions still awaited
+        self.published: dict[str, float] = {}  # time.perf_counter() of their publication
+        self.inline: dict[str, dict] = {}  # requests sent by hash, to send again with their code
+        self.memo = Memoization(result_cache, flights)
 
     def request_execution(self, request: dict, flavour: str, mode: str) -> str:
         """Queue an execution request to be processed by an SR instance
@@ -121,56 +655,419 @@ class Executioner():
         Returns:
             str: Request ID of the requested execution
         """
-        # Tag offload request with an ID in order to wait for results
-        request_id = str(uuid.uuid4())
-        execution_request = {"request_id": request_id,
-                             "mode": mode,
-                             "payload": request}
+        return self.request_executions([request], flavour, mode)[0]
+
+    def request_executions(self, requests: list[dict], flavour: str, mode: str) -> list[str]:
+        """Queue several execution requests to the same flavour in one pass
+
+        Returns:
+            list[str]: Request IDs of the requested executions, in the same order
+        """
+        # Tag offload requests with an ID in order to wait for results
+        request_ids = [str(uuid.uuid4()) for _ in requests]
+        execution_requests = [{"request_id": request_id,
+                               "mode": mode,
+                               "payload": request}
+                              for request_id, request in zip(request_ids, requests)]
 
         self.broker.logger.info("Requesting execution")
-        self.broker.logger.debug(execution_request)
+        self.broker.logger.debug(execution_requests)
+
+        # asynchronous executions are not awaited
+        awaited = mode != ExecutionMode.ASYNC
+
+        if self.admission is not None:
+            depth = self.admission.queue_depth(flavour, len(requests))
+
+            if depth is None:
+                depth = self.broker.queue_depth(flavour)
+                self.admission.update_queue_depth(flavour, depth)
+
+            self.admission.admit(flavour, len(requests), depth, in_flight=awaited)
+
+        if awaited:
+            self.flavours.update((request_id, flavour) for request_id in request_ids)
+
+            # only awaited executions can be sent again when the SR lacks their code
+            if self.function_code is not None:
+                self.inline.update(zip(request_ids, execution_requests))
+                execution_requests = [self.function_code.by_hash(execution_request)
+                                      for execution_request in execution_requests]
+
+        try:
+            with metrics.EXECUTION_REQUEST.time(flavour=flavour, mode=mode):
+                self._request_executions(request_ids, execution_requests, flavour, mode)
+        except Exception:
+            self.forget_executions(request_ids)
+            raise
+
+        self.published.update(dict.fromkeys(request_ids, time.perf_counter()))
 
-        # Create temporary results queue to
-        # avoid race condition with exchange dropping result messages before result queue exists
-        channel = self.broker.connection.channel()
-        temp_queue = channel.queue_declare(
-            queue=f"results_{request_id}", exclusive=True, auto_delete=True).method.queue
-        channel.queue_bind(exchange='results',
-                           queue=temp_queue, routing_key=request_id)
-        channel.close
+        return request_ids
 
-        self.broker.send_message(
-            message=execution_request, routing_key=flavour)
+    def _request_executions(self, request_ids: list[str], execution_requests: list[dict], flavour: str,
+                            mode: str):
+        reply_to = None
 
-        return request_id
+        if self.object_store is not None:
+            self.object_store.offload(execution_requests)
 
-    def await_execution(self, request_id: str) -> str:
-        result = self.broker.receive_message(
-            routing_key=request_id, queue=f"results_{request_id}")
+        if mode == ExecutionMode.ASYNC:
+            # Results wait in the broker until the client asks for them, from any worker
+            channel = self.broker.publish_channel()
+
+            for request_id in request_ids:
+                declare_result_queue(channel, request_id, self.one.username)
+        elif self.dispatcher is not None:
+            # Route the results to the shared reply queue before they can be published
+            for request_id in request_ids:
+                self.results[request_id] = self.dispatcher.register(request_id)
+
+            reply_to = self.dispatcher.reply_to
+        else:
+            # Create temporary results queues to
+            # avoid race condition with exchange dropping result messages before result queue exists
+            channel = self.broker.publish_channel()
+
+            for request_id in request_ids:
+                temp_queue = channel.queue_declare(queue=result_queue(request_id, self.one.username),
+                                                   exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(exchange='results',
+                                   queue=temp_queue, routing_key=request_id)
+
+        properties = [request_properties(request_id, flavour, deadline=self.deadline, reply_to=reply_to)
+                      for request_id in request_ids]
+
+        try:
+            self.broker.send_messages(
+                messages=execution_requests, routing_key=flavour, properties=properties)
+        except Exception:
+            if self.dispatcher is not None:
+                for request_id in request_ids:
+                    self.dispatcher.release(request_id)
+                    self.results.pop(request_id, None)
+            raise
+
+    def await_execution(self, request_id: str) -> dict:
+        """Wait for the result of an execution until the deadline
+
+        Raises:
+            HTTPException: 504 if the deadline passes before the result arrives
+        """
+        if request_id in self.memo.cached:
+            return self.memo.cached.pop(request_id)
+
+        if request_id in self.memo.following:
+            return self._follow(request_id)
+
+        # popped before waiting, the executions forgotten with their key are the abandoned ones
+        key = self.memo.result_keys.pop(request_id, None)
+
+        try:
+            result = self._await_published(request_id)
+        except BaseException as e:
+            self.memo.land(key, error=e)
+            raise
+
+        self.memo.land(key, result)
+
+        return result
+
+    def _await_published(self, request_id: str) -> dict:
+        with metrics.EXECUTION_WAIT.time(start=self.published.get(request_id),
+                                         flavour=self.flavours.get(request_id)) as timer:
+            try:
+                result = self._receive_result(request_id)
+
+                if result is not None and result["code"] == FUNCTION_CODE_MISSING and request_id in self.inline:
+                    self._send_inline(request_id)
+                    result = self._receive_result(request_id)
+            finally:
+                self.forget_executions([request_id])
+
+            if result is None:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_TIMEOUT)
+
+            timer.label(outcome=result_outcome(result))
 
         self.broker.logger.info("Execution result received")
         self.broker.logger.debug(result)
 
         return result
 
-    def execute_function(self, function_id: int, app_req_id: int, parameters: list[str], mode: str) -> dict:
+    def _follow(self, request_id: str) -> dict:
+        """Wait for the result of the identical execution in flight joined by an execution. If that one
+        ends without result, join the next one or run the execution
+        """
+        flight, key, execution_request, flavour = self.memo.following.pop(request_id)
+
+        while flight is not None:
+            try:
+                result = flight.result(timeout=remaining_time(self.deadline))
+            except FutureTimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_TIMEOUT)
+
+            if result is not None:
+                return result
+
+            flight = self.memo.rejoin(key)
+
+        return self.await_execution(self._request_memoized([key], [execution_request], flavour)[0])
+
+    def _request_memoized(self, keys: list[tuple[str, str]], execution_requests: list[dict],
+                          flavour: str) -> list[str]:
+        """Publish executions whose results are cached and shared, releasing the identical executions
+        joined to them if they could not be published
+        """
+        try:
+            request_ids = self.request_executions(execution_requests, flavour, mode=ExecutionMode.SYNC)
+        except Exception as e:
+            for key in keys:
+                self.memo.land(key, error=e)
+            raise
+
+        self.memo.published(keys, request_ids)
+
+        return request_ids
+
+    def _send_inline(self, request_id: str):
+        """Send an execution requested by hash again, with its function code"""
+        self.broker.logger.info(f"Function code of {request_id} not available, sending it inline")
+
+        execution_request = self.inline.pop(request_id)
+        flavour = self.flavours[request_id]
+
+        if self.dispatcher is None or self.broker_pool is None:
+            self._request_executions([request_id], [execution_request], flavour, ExecutionMode.SYNC)
+            return
+
+        # the connection the execution was requested with may have been returned to the pool
+        with self.broker_pool.borrow() as broker_client:
+            executioner = Executioner(broker_client=broker_client, one_client=self.one, dispatcher=self.dispatcher,
+                                      deadline=self.deadline, object_store=self.object_store)
+            executioner._request_executions([request_id], [execution_request], flavour, ExecutionMode.SYNC)
+
+        self.results[request_id] = executioner.results.pop(request_id)
+
+    def _receive_result(self, request_id: str) -> dict | None:
+        if self.dispatcher is not None:
+            try:
+                return self.results.pop(request_id).result(timeout=remaining_time(self.deadline))
+            except FutureTimeoutError:
+                return None
+            finally:
+                self.dispatcher.release(request_id)
+
+        return self.broker.receive_message(routing_key=request_id,
+                                           queue=result_queue(request_id, self.one.username),
+                                           timeout=remaining_time(self.deadline))
+
+    def submit_function(self, function_id: int, app_req_id: int, parameters: list[str], mode: str) -> str:
+        """Read the function and its requirements and queue its execution
+
+        Returns:
+            str: Request ID of the requested execution
+        """
+        return self.submit_batch(function_id, app_req_id, [parameters], mode)[0]
+
+    def submit_batch(self, function_id: int, app_req_id: int, parameter_sets: list[list[str]], mode: str,
+                     memoize: bool = False) -> list[str]:
+        """Read the function and its requirements once and queue one execution per set of parameters
+
+        Args:
+            memoize (bool, optional): Reuse cached results of synchronous executions even if the
+                requirements do not declare the function deterministic. Defaults to False.
+
+        Returns:
+            list[str]: Request IDs of the requested executions, in the same order
+        """
         function = self.one.get_function(function_id)
         requirement = self.one.get_app_requirement(app_req_id)
 
-        execution_request = prepare_execution_request(
-            function, parameters, app_req_id)
+        execution_requests = [prepare_execution_request(function, parameters, app_req_id)
+                              for parameters in parameter_sets]
 
-        # Publish execution request to an exchange. Use flavour as routing key.
-        execution_id = self.request_execution(
-            execution_request, requirement["FLAVOUR"], mode=mode)
+        if not self.memo.applies(mode, memoize, requirement):
+            # Publish execution request to an exchange. Use flavour as routing key.
+            return self.request_executions(
+                execution_requests, requirement["FLAVOUR"], mode=mode)
 
-        result = self.await_execution(execution_id)
+        # only the executions without cached result nor identical execution in flight are published
+        request_ids, keys, missing = self.memo.plan(
+            function, parameter_sets, execution_requests, requirement["FLAVOUR"])
 
-        if result["code"] != 200:
-            raise HTTPException(
-                status_code=result["code"], detail=result["message"])
+        if missing:
+            published = self._request_memoized([keys[index] for index in missing],
+                                               [execution_requests[index] for index in missing],
+                                               requirement["FLAVOUR"])
+
+            for index, request_id in zip(missing, published):
+                request_ids[index] = request_id
+
+        return request_ids
+
+    def collect_result(self, request_id: str) -> dict:
+        """Wait for the result of a submitted execution
+
+        Raises:
+            HTTPException: With the code of the execution if it was not successful
+        """
+        return result_message(self.await_execution(request_id))
+
+    def collect_results(self, request_ids: list[str]) -> list[dict]:
+        """Wait for the results of several submitted executions. Unsuccessful executions do not raise,
+        every result keeps the code and message returned by the SR.
+        """
+        results = []
+
+        try:
+            for request_id in request_ids:
+                results.append(self.await_execution(request_id))
+        finally:
+            # results still pending when a wait failed are not routed anymore
+            if len(results) < len(request_ids):
+                self.discard_results(request_ids[len(results):])
+
+        return results
+
+    def discard_results(self, request_ids: list[str]):
+        """Stop waiting for the results of executions"""
+        # results found in the cache were never requested
+        request_ids = [request_id for request_id in request_ids if not self.memo.answered(request_id)]
+
+        self.forget_executions(request_ids)
+
+        if self.dispatcher is not None:
+            for request_id in request_ids:
+                if self.results.pop(request_id, None) is not None:
+                    self.dispatcher.release(request_id)
+            return
+
+        # temporary results queues are only deleted with the connection if never consumed from
+        try:
+            channel = self.broker.publish_channel()
+
+            for request_id in request_ids:
+                channel.queue_delete(queue=result_queue(request_id, self.one.username))
+        except pika.exceptions.AMQPError as e:
+            self.broker.logger.warning(f"Could not delete results queues: {e}")
+
+    def forget_executions(self, request_ids: list[str]):
+        """Stop accounting executions as awaited"""
+        for request_id in request_ids:
+            flavour = self.flavours.pop(request_id, None)
+            self.published.pop(request_id, None)
+            self.inline.pop(request_id, None)
+            self.memo.forget(request_id)
+
+            if flavour is not None and self.admission is not None:
+                self.admission.release(flavour)
+
+    def execute_function(self, function_id: int, app_req_id: int, parameters: list[str], mode: str) -> dict:
+        execution_id = self.submit_function(
+            function_id, app_req_id, parameters, mode)
+
+        return self.collect_result(execution_id)
+
+
+def result_queue(request_id: str, owner: str) -> str:
+    """Name of the queue the result of an execution is delivered to. Queues are scoped by the user
+    that requested the execution, other users asking for the same request ID look for another queue.
+    """
+    return f"results_{owner_id(owner)}_{request_id}"
+
+
+@functools.lru_cache(maxsize=1024)
+def owner_id(owner: str) -> str:
+    # user names may hold characters and lengths queue names do not
+    return hashlib.sha256(owner.encode()).hexdigest()[:32]
+
+
+def declare_result_queue(channel: BlockingChannel, request_id: str, owner: str):
+    """Declare the queue keeping the result of an asynchronous execution. Both the queue and the
+    result are dropped by the broker once unused for RESULT_TTL seconds.
+    """
+    queue = result_queue(request_id, owner)
+
+    channel.queue_declare(queue=queue, arguments=result_queue_arguments())
+    channel.queue_bind(exchange='results', queue=queue, routing_key=request_id)
+
+
+def result_queue_arguments() -> dict:
+    return {'x-expires': RESULT_TTL * 1000, 'x-message-ttl': RESULT_TTL * 1000}
+
+
+def request_properties(request_id: str, flavour: str, deadline: float = None,
+                       reply_to: str = None) -> pika.BasicProperties:
+    """Properties of an execution request, encoded as the SRs of its flavour expect. Requests still
+    queued once the deadline has passed are dropped by the broker instead of being executed for a
+    client that gave up on them.
+    """
+    properties = pika.BasicProperties(content_type=WIRE_FORMATS.get(flavour, wire.JSON), message_id=request_id)
+
+    if deadline is not None:
+        properties.expiration = str(max(1, int((deadline - time.monotonic()) * 1000)))
+
+    if reply_to is not None:
+        properties.correlation_id = request_id
+        properties.reply_to = reply_to
+
+    return properties
+
+
+def remaining_time(deadline: float) -> float | None:
+    """Seconds left until a time.monotonic() deadline, None without deadline
+
+    Raises:
+        HTTPException: 504 if the deadline has passed
+    """
+    if deadline is None:
+        return None
+
+    remaining = deadline - time.monotonic()
+
+    if remaining <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_TIMEOUT)
+
+    return remaining
+
+
+def result_outcome(result: dict) -> str:
+    """Metrics outcome of an execution result"""
+    return 'ok' if result["code"] == 200 else str(result["code"])
+
+
+def result_message(result: dict) -> dict:
+    """Message of an execution result
+
+    Raises:
+        HTTPException: With the code of the execution if it was not successful
+    """
+    if result["code"] != 200:
+        raise HTTPException(
+            status_code=result["code"], detail=result["message"])
+
+    return result["message"]
+
+
+def connection_parameters(broker_endpoint: str) -> pika.ConnectionParameters:
+    endpoint = urlparse(broker_endpoint)
+
+    parameters = pika.ConnectionParameters(
+        host=endpoint.hostname, port=endpoint.port)
+
+    if endpoint.scheme == 'ssl':
+        # trust ssl certificates
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+        parameters.ssl_options = pika.SSLOptions(context=ssl_context)
 
-        return result["message"]
+    return parameters
 
 
 def prepare_execution_request(function_document: dict, params: list[str], app_req_id: int) -> dict:
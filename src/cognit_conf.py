@@ -1,10 +1,7 @@
 import yaml
 import os
-import socket
-import sys
-from urllib.parse import urlparse
 
-PATH = "/etc/cognit-edge_cluster_frontend.conf"
+PATH = os.environ.get('COGNIT_EDGE_CLUSTER_FRONTEND_CONF', "/etc/cognit-edge_cluster_frontend.conf")
 DEFAULT = {
     'host': '0.0.0.0',
     'port': 1339,
@@ -12,14 +9,69 @@ DEFAULT = {
     'oneflow': 'http://localhost:2474',
     'cognit_frontend': 'http://localhost:1338',
     'cluster_id': 0,
+    'load_balancer': 'cpu',
+    'offload_connect_timeout': 5,
+    'offload_read_timeout': 60,
+    'offload_connections': 10,
+    'offload_pool_timeout': 5,
+    'runtime_index': False,
+    'runtime_index_interval': 10,
     'broker': 'http://localhost:5672',
+    'broker_pool_size': 40,
+    'reply_queue': 'exclusive',
+    'execution_backend': 'blocking',
+    'wire_formats': {},
+    'function_code': 'inline',
+    'function_code_ttl': 3600,
+    'function_code_size': 256,
+    'result_cache_ttl': 300,
+    'result_cache_size': 67108864,
+    'execution_timeout': 55,
+    'execution_timeout_limit': 300,
+    'batch_size_limit': 100,
+    'max_in_flight': 0,
+    'max_queue_depth': 0,
+    'queue_depth_ttl': 1,
+    'retry_after': 5,
+    'metrics': False,
+    'device_metrics_size': 256,
+    'device_metrics_devices': 1000,
+    'device_metrics_user_devices': 16,
+    'device_metrics_flavours': [],
+    'device_metrics_rate_window': 60,
+    'device_metrics_flush_interval': 0,
+    'result_ttl': 3600,
+    'result_wait_limit': 30,
+    'stream_timeout': 300,
+    'stream_limit': 16,
+    'poll_limit': 16,
+    'one_client_pool_size': 256,
+    'document_cache_ttl': 30,
+    'document_cache_size': 1024,
+    'token_cache_ttl': 60,
+    'token_cache_size': 4096,
+    'key_refresh_interval': 300,
+    'key_refresh_min_interval': 10,
+    'key_grace_period': 3600,
+    'object_store': '',
+    'object_store_access_key': '',
+    'object_store_secret_key': '',
+    'object_store_bucket': 'cognit-executions',
+    'object_store_threshold': 1048576,
+    'object_store_url_ttl': 3600,
+    'object_store_retention': 1,
+    'readiness_interval': 5,
+    'readiness_timeout': 5,
     'workers': 1,
     'log_level': 'info'
 }
 
 FALLBACK_MSG = 'Using default configuration'
+WIRE_FORMATS_ALLOWED = ('json', 'msgpack')  # keys of wire.CONTENT_TYPES
 
 
+user_config = {}
+
 if os.path.exists(PATH):
     with open(PATH, 'r') as file:
         try:
@@ -28,39 +80,87 @@ if os.path.exists(PATH):
                 user_config = {}
         except yaml.YAMLError as e:
             print(f"{e}\n{FALLBACK_MSG}")
-            config = DEFAULT
+            user_config = {}
 else:
     print(f"{PATH} not found. {FALLBACK_MSG}.")
-    config = DEFAULT
 
 config = DEFAULT.copy()
 config.update(user_config)
 
+if config['wire_formats'] is None:
+    config['wire_formats'] = {}
+
+if not isinstance(config['wire_formats'], dict):
+    raise SystemExit(f"{PATH}: wire_formats must map flavours to one of {', '.join(WIRE_FORMATS_ALLOWED)}, "
+                     f"e.g. {{Energy: msgpack}}")
+
+for flavour, wire_format in config['wire_formats'].items():
+    if wire_format not in WIRE_FORMATS_ALLOWED:
+        raise SystemExit(f"{PATH}: unknown wire format '{wire_format}' for flavour {flavour} in wire_formats, "
+                         f"use one of {', '.join(WIRE_FORMATS_ALLOWED)}")
+
+# flavours are matched by name, also those YAML reads as numbers
+config['wire_formats'] = {str(flavour): wire_format for flavour, wire_format in config['wire_formats'].items()}
+
 ONE_XMLRPC = config['one_xmlrpc']
 ONEFLOW = config['oneflow']
 COGNIT_FRONTEND = config['cognit_frontend']
 CLUSTER_ID = config['cluster_id']
+LOAD_BALANCER = config['load_balancer']
+OFFLOAD_CONNECT_TIMEOUT = config['offload_connect_timeout']
+OFFLOAD_READ_TIMEOUT = config['offload_read_timeout']
+OFFLOAD_CONNECTIONS = config['offload_connections']
+OFFLOAD_POOL_TIMEOUT = config['offload_pool_timeout']
+RUNTIME_INDEX = config['runtime_index']
+RUNTIME_INDEX_INTERVAL = config['runtime_index_interval']
 BROKER = config['broker']
+BROKER_POOL_SIZE = config['broker_pool_size']
+REPLY_QUEUE = config['reply_queue']
+EXECUTION_BACKEND = config['execution_backend']
+WIRE_FORMATS = config['wire_formats']
+FUNCTION_CODE = config['function_code']
+FUNCTION_CODE_TTL = config['function_code_ttl']
+FUNCTION_CODE_SIZE = config['function_code_size']
+RESULT_CACHE_TTL = config['result_cache_ttl']
+RESULT_CACHE_SIZE = config['result_cache_size']
+EXECUTION_TIMEOUT = config['execution_timeout']
+EXECUTION_TIMEOUT_LIMIT = config['execution_timeout_limit']
+BATCH_SIZE_LIMIT = config['batch_size_limit']
+MAX_IN_FLIGHT = config['max_in_flight']
+MAX_QUEUE_DEPTH = config['max_queue_depth']
+QUEUE_DEPTH_TTL = config['queue_depth_ttl']
+RETRY_AFTER = config['retry_after']
+METRICS = config['metrics']
+DEVICE_METRICS_SIZE = config['device_metrics_size']
+DEVICE_METRICS_DEVICES = config['device_metrics_devices']
+DEVICE_METRICS_USER_DEVICES = config['device_metrics_user_devices']
+DEVICE_METRICS_FLAVOURS = config['device_metrics_flavours']
+DEVICE_METRICS_RATE_WINDOW = config['device_metrics_rate_window']
+DEVICE_METRICS_FLUSH_INTERVAL = config['device_metrics_flush_interval']
+RESULT_TTL = config['result_ttl']
+RESULT_WAIT_LIMIT = config['result_wait_limit']
+STREAM_TIMEOUT = config['stream_timeout']
+STREAM_LIMIT = config['stream_limit']
+POLL_LIMIT = config['poll_limit']
+ONE_CLIENT_POOL_SIZE = config['one_client_pool_size']
+DOCUMENT_CACHE_TTL = config['document_cache_ttl']
+DOCUMENT_CACHE_SIZE = config['document_cache_size']
+TOKEN_CACHE_TTL = config['token_cache_ttl']
+TOKEN_CACHE_SIZE = config['token_cache_size']
+KEY_REFRESH_INTERVAL = config['key_refresh_interval']
+KEY_REFRESH_MIN_INTERVAL = config['key_refresh_min_interval']
+KEY_GRACE_PERIOD = config['key_grace_period']
+OBJECT_STORE = config['object_store']
+OBJECT_STORE_ACCESS_KEY = config['object_store_access_key']
+OBJECT_STORE_SECRET_KEY = config['object_store_secret_key']
+OBJECT_STORE_BUCKET = config['object_store_bucket']
+OBJECT_STORE_THRESHOLD = config['object_store_threshold']
+OBJECT_STORE_URL_TTL = config['object_store_url_ttl']
+OBJECT_STORE_RETENTION = config['object_store_retention']
+READINESS_INTERVAL = config['readiness_interval']
+READINESS_TIMEOUT = config['readiness_timeout']
 WORKERS = config['workers']
 
-for endpoint in [ONE_XMLRPC, ONEFLOW]:
-    one = urlparse(endpoint)
-
-    if one.port is None:
-        if one.scheme == 'https':
-            port = 443
-        elif one.scheme == 'http':
-            port = 80
-    else:
-        port = one.port
-
-    try:
-        socket.create_connection((one.hostname, port), timeout=5)
-    except socket.error as e:
-        sys.stderr.write(
-            f"Error: Unable to connect to OpenNebula at {endpoint} {str(e)}")
-        sys.exit(1)
-
 HOST = config['host']
 PORT = config['port']
 LOG_LEVEL = config['log_level']
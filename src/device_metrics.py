@@ -0,0 +1,267 @@
+from array import array
+from collections import OrderedDict, deque
+from typing import Iterable
+import logging
+import math
+import threading
+import time
+
+from cognit_broker import BrokerPool
+
+EXCHANGE = 'device_metrics'  # fanout exchange uploads are forwarded to
+PERCENTILES = (50, 95, 99)
+MAX_METRICS = 16  # metric names kept per device
+PENDING_LIMIT = 10000  # uploads waiting to be forwarded, the oldest are dropped beyond it
+RESERVED_KEYS = ('device_id', 'flavour')
+
+
+class RingBuffer:
+    """Last samples of a metric with the time they were received. Storage is allocated once,
+    adding a sample does not allocate.
+    """
+
+    __slots__ = ('values', 'times', 'size', 'next', 'count')
+
+    def __init__(self, size: int):
+        self.values = array('d', bytes(8 * size))
+        self.times = array('d', bytes(8 * size))
+        self.size = size
+        self.next = 0
+        self.count = 0
+
+    def append(self, value: float, timestamp: float):
+        self.values[self.next] = value
+        self.times[self.next] = timestamp
+        self.next = (self.next + 1) % self.size
+
+        if self.count < self.size:
+            self.count += 1
+
+    def summary(self, now: float, window: float) -> dict:
+        """Percentiles of the kept samples and rate of samples received within the window"""
+        values = sorted(self.values[:self.count])
+        since = now - window
+
+        summary = {
+            'count': self.count,
+            'last': self.values[self.next - 1],
+            'rate': sum(1 for received in self.times[:self.count] if received >= since) / window
+        }
+
+        for percentile in PERCENTILES:
+            rank = max(0, math.ceil(percentile / 100 * len(values)) - 1)
+            summary[f'p{percentile}'] = values[rank]
+
+        return summary
+
+
+class DeviceMetrics:
+    """Recent metrics uploaded by devices, kept in fixed size ring buffers per device and metric.
+
+    Every numeric value of an upload is a sample of the metric named by its key, lists hold several
+    samples. Uploads naming one of the known flavours are also aggregated per flavour, so load
+    balancing and admission can compare the latencies observed across the devices using it. When a
+    broker pool is given, uploads are forwarded in batches to the device_metrics exchange every flush
+    interval.
+    """
+
+    def __init__(self, logger: logging.Logger, size: int, devices: int, user_devices: int, rate_window: float,
+                 flavours: Iterable[str] = (), flush_interval: float = 0, broker_pool: BrokerPool = None):
+        """
+        Args:
+            size (int): Samples kept per metric
+            devices (int): Devices kept, the least recently updated ones are forgotten beyond it
+            user_devices (int): Devices kept per user, the least recently updated ones of the same user
+                are forgotten beyond it
+            rate_window (float): Seconds sample rates are computed over
+            flavours (Iterable[str], optional): Flavours whose samples are aggregated. Defaults to none.
+            flush_interval (float, optional): Seconds between batches forwarded to the broker.
+                Defaults to not forwarding uploads.
+            broker_pool (BrokerPool, optional): Connections batches are forwarded with
+        """
+        self.logger = logger
+        self.size = size
+        self.max_devices = devices
+        self.max_user_devices = user_devices
+        self.rate_window = rate_window
+        self.known_flavours = frozenset(flavours)
+        self.flush_interval = flush_interval
+        self.broker_pool = broker_pool
+
+        self.devices: OrderedDict[tuple[str, str], dict[str, RingBuffer]] = OrderedDict()
+        self.user_devices: dict[str, OrderedDict[str, None]] = {}  # device IDs of each user, least recent first
+        self.flavours: dict[str, dict[str, RingBuffer]] = {flavour: {} for flavour in self.known_flavours}
+        self.lock = threading.Lock()
+
+        self.pending: deque[dict] = deque(maxlen=PENDING_LIMIT)
+        self.stopped = threading.Event()
+        self.thread: threading.Thread = None
+
+    @property
+    def forwarding(self) -> bool:
+        return self.flush_interval > 0 and self.broker_pool is not None
+
+    def ingest(self, user: str, metrics: dict) -> int:
+        """Store the samples of an upload
+
+        Args:
+            user (str): User the device authenticated as
+            metrics (dict): Uploaded metrics, optionally naming the device_id and flavour
+
+        Returns:
+            int: Number of samples stored
+        """
+        device_id = str(metrics.get('device_id', ''))
+        flavour = metrics.get('flavour')
+        now = time.time()
+        stored = 0
+
+        with self.lock:
+            device = self._device(user, device_id)
+            flavour_buffers = self.flavours.get(flavour) if isinstance(flavour, str) else None
+
+            for name, samples in metrics.items():
+                if name in RESERVED_KEYS:
+                    continue
+
+                if not isinstance(samples, list):
+                    samples = (samples,)
+
+                for value in samples:
+                    # bool is an int, but not a measure
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        continue
+
+                    # ints may not fit a double
+                    try:
+                        value = float(value)
+                    except OverflowError:
+                        continue
+
+                    if not math.isfinite(value):
+                        continue
+
+                    buffer = self._buffer(device, name)
+
+                    if buffer is None:
+                        break
+
+                    buffer.append(value, now)
+                    stored += 1
+
+                    if flavour_buffers is not None:
+                        buffer = self._buffer(flavour_buffers, name)
+
+                        if buffer is not None:
+                            buffer.append(value, now)
+
+        if self.forwarding:
+            self.pending.append({'user': user, 'timestamp': now, 'metrics': metrics})
+
+        return stored
+
+    def summary(self, user: str, device_id: str = None) -> dict:
+        """Aggregates of every metric of the devices of a user
+
+        Returns:
+            dict: Metric summaries by device ID
+        """
+        now = time.time()
+
+        with self.lock:
+            return {device: self._summary(buffers, now)
+                    for (owner, device), buffers in self.devices.items()
+                    if owner == user and device_id in (None, device)}
+
+    def flavour_summary(self, flavour: str) -> dict | None:
+        """Aggregates of every metric uploaded for a flavour by the devices of every user. For internal
+        use, they mix the uploads of every user.
+        """
+        with self.lock:
+            buffers = self.flavours.get(flavour)
+
+            if buffers is None:
+                return None
+
+            return self._summary(buffers, time.time())
+
+    def start(self):
+        if not self.forwarding:
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._flush_periodically, name="device-metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval)
+            self.thread = None
+
+    def flush(self):
+        """Forward the pending uploads to the broker as a single message"""
+        batch = []
+
+        while self.pending:
+            batch.append(self.pending.popleft())
+
+        if not batch:
+            return
+
+        try:
+            with self.broker_pool.borrow() as broker_client:
+                broker_client.publish(exchange=EXCHANGE, message=batch)
+        except Exception as e:
+            self.logger.warning(f"Could not forward {len(batch)} device metrics uploads: {e}")
+            return
+
+        self.logger.debug(f"Forwarded {len(batch)} device metrics uploads")
+
+    def _flush_periodically(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+        self.flush()
+
+    def _device(self, user: str, device_id: str) -> dict[str, RingBuffer]:
+        """Buffers of a device, forgetting the least recently updated device of the same user, or of
+        any user, beyond the limits
+        """
+        key = (user, device_id)
+        buffers = self.devices.get(key)
+        user_devices = self.user_devices.setdefault(user, OrderedDict())
+
+        if buffers is not None:
+            self.devices.move_to_end(key)
+            user_devices.move_to_end(device_id)
+            return buffers
+
+        buffers = self.devices[key] = {}
+        user_devices[device_id] = None
+
+        if len(user_devices) > self.max_user_devices:
+            forgotten, _ = user_devices.popitem(last=False)
+            del self.devices[(user, forgotten)]
+
+        while len(self.devices) > self.max_devices:
+            (owner, forgotten), _ = self.devices.popitem(last=False)
+            owner_devices = self.user_devices[owner]
+            del owner_devices[forgotten]
+
+            if not owner_devices:
+                del self.user_devices[owner]
+
+        return buffers
+
+    def _buffer(self, buffers: dict[str, RingBuffer], name: str) -> RingBuffer | None:
+        buffer = buffers.get(name)
+
+        if buffer is None and len(buffers) < MAX_METRICS:
+            buffer = buffers[name] = RingBuffer(self.size)
+
+        return buffer
+
+    def _summary(self, buffers: dict[str, RingBuffer], now: float) -> dict:
+        return {name: buffer.summary(now, self.rate_window) for name, buffer in buffers.items()}
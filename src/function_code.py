@@ -0,0 +1,69 @@
+from fastapi import HTTPException
+import hashlib
+
+from cache import TTLCache
+from object_store import ObjectStore
+
+
+class FunctionCodeStore:
+    """Function code of recent executions, uploaded to the object store under the SHA-256 of its base64 text.
+
+    Execution requests sent by hash carry the digest and a presigned URL of the code instead of the code.
+    SRs download unknown code once and keep it, answering FUNCTION_CODE_MISSING when it is not available,
+    in which case the request is sent again with the code inline. Every worker shares the bucket, and the
+    code is only reachable through the URLs given to the SRs.
+    """
+
+    def __init__(self, object_store: ObjectStore, ttl: float, size: int):
+        """
+        Args:
+            ttl (float): Seconds before the code of a function is uploaded again
+            size (int): Functions known to be uploaded, the least recently executed are evicted
+        """
+        self.object_store = object_store
+        self.uploaded = TTLCache(ttl=ttl, size=size)  # SHA-256 of the code in the bucket -> True
+        self.digests = TTLCache(ttl=ttl, size=size)  # code -> SHA-256, to hash each code once
+
+    def put(self, fc: str) -> str:
+        """Upload the code of an execution unless it was uploaded recently
+
+        Returns:
+            str: Hex SHA-256 of the code
+
+        Raises:
+            HTTPException: 503 if the code could not be uploaded
+        """
+        digest = self.digests.get(fc)
+
+        if digest is None:
+            digest = hashlib.sha256(fc.encode()).hexdigest()
+            self.digests.set(fc, digest)
+
+        # uploaded again every ttl, so the object outlives the bucket retention while the function is executed
+        if self.uploaded.get(digest) is None:
+            self.object_store.upload(code_key(digest), fc)
+            self.uploaded.set(digest, True)
+
+        return digest
+
+    def by_hash(self, execution_request: dict) -> dict:
+        """Copy of an execution request carrying the hash and URL of its function code instead of the code.
+        The request is kept as is if the code cannot be uploaded.
+        """
+        payload = dict(execution_request["payload"])
+
+        try:
+            digest = self.put(payload["fc"])
+        except HTTPException:
+            return execution_request
+
+        del payload["fc"]
+        payload["fc_hash"] = digest
+        payload["fc_url"] = self.object_store.url(code_key(digest))
+
+        return {**execution_request, "payload": payload}
+
+
+def code_key(digest: str) -> str:
+    """Object key of a function code"""
+    return f"functions/{digest}"
@@ -0,0 +1,119 @@
+from fastapi import HTTPException, status
+from typing import Awaitable, Callable, Iterable
+from urllib.parse import urlparse
+import asyncio
+import contextlib
+import logging
+import math
+
+ERROR_NOT_READY = "Service dependencies are not ready"
+ERROR_NOT_CHECKED = "Not checked yet"
+
+Probe = Callable[[], Awaitable]
+
+
+class Readiness:
+    """State of the services requests depend on. Every dependency is probed concurrently on the
+    event loop once per interval, so a slow or missing dependency neither delays startup nor blocks
+    the checks of the others. A probe succeeds unless it raises or exceeds the timeout.
+    """
+
+    def __init__(self, logger: logging.Logger, probes: dict[str, Probe], interval: float, timeout: float,
+                 optional: Iterable[str] = ()):
+        """
+        Args:
+            probes (dict[str, Probe]): Coroutine functions checking each dependency, by name
+            interval (float): Seconds between checks
+            timeout (float): Seconds each probe may take
+            optional (Iterable[str], optional): Dependencies only reported, the service is ready
+                without them
+        """
+        self.logger = logger
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self.optional = frozenset(optional)
+
+        # None for dependencies that passed their last check, the reason of the failure otherwise
+        self.errors: dict[str, str | None] = {name: ERROR_NOT_CHECKED for name in probes}
+        self.task: asyncio.Task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(error is None for name, error in self.errors.items() if name not in self.optional)
+
+    def start(self):
+        self.task = asyncio.create_task(self._check_periodically())
+
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.task.cancel()
+
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
+
+        self.task = None
+
+    async def check(self):
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in self.probes.items()))
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'dependencies': {name: {'ready': error is None, 'error': error}
+                             for name, error in self.errors.items()}
+        }
+
+    def require(self, dependencies: Iterable[str]):
+        """
+        Args:
+            dependencies (Iterable[str]): Dependencies the request needs, those not probed are ignored
+
+        Raises:
+            HTTPException: 503 while any of the dependencies is not ready
+        """
+        pending = ', '.join(name for name in dependencies if self.errors.get(name) is not None)
+
+        if not pending:
+            return
+
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"{ERROR_NOT_READY}: {pending}",
+                            headers={"Retry-After": str(math.ceil(self.interval))})
+
+    async def _check_periodically(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    async def _probe(self, name: str, probe: Probe):
+        try:
+            await asyncio.wait_for(probe(), timeout=self.timeout)
+            error = None
+        except asyncio.TimeoutError:
+            error = f"No answer within {self.timeout} seconds"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        previous = self.errors[name]
+        self.errors[name] = error
+
+        if error is None and previous is not None:
+            self.logger.info(f"Dependency {name} is ready")
+        elif error is not None and error != previous:
+            self.logger.warning(f"Dependency {name} is not ready: {error}")
+
+
+async def probe_endpoint(endpoint: str):
+    """Open and close a TCP connection to the host of an HTTP endpoint"""
+    url = urlparse(endpoint)
+    port = url.port
+
+    if port is None:
+        port = 443 if url.scheme == 'https' else 80
+
+    _, writer = await asyncio.open_connection(url.hostname, port)
+    writer.close()
+    await writer.wait_closed()
@@ -0,0 +1,126 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+import threading
+import random
+
+MAX_CANDIDATE_SETS = 256  # sets of runtimes whose round robin state is kept, the least recently used are forgotten
+
+
+class Runtime(NamedTuple):
+    vm_id: int
+    endpoint: str | None  # None until the VM NIC has been read
+    cpu: float
+
+
+class LoadBalancer(ABC):
+    """Selects the Serverless Runtime an execution is offloaded to. Every strategy keeps track of the
+    executions this worker has in flight on each Serverless Runtime.
+    """
+
+    def __init__(self):
+        self.outstanding: dict[int, int] = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def select(self, runtimes: list[Runtime]) -> Runtime:
+        pass
+
+    def load(self, runtimes: list[Runtime]) -> dict[int, int]:
+        """Executions in flight on each runtime"""
+        with self.lock:
+            return {runtime.vm_id: self.outstanding.get(runtime.vm_id, 0) for runtime in runtimes}
+
+    @contextmanager
+    def track(self, runtime: Runtime) -> Iterator[Runtime]:
+        """Account an execution as in flight on the runtime while the context is open"""
+        with self.lock:
+            self.outstanding[runtime.vm_id] += 1
+
+        try:
+            yield runtime
+        finally:
+            with self.lock:
+                self.outstanding[runtime.vm_id] -= 1
+
+                if self.outstanding[runtime.vm_id] == 0:
+                    del self.outstanding[runtime.vm_id]
+
+
+class CPULoadBalancer(LoadBalancer):
+    """Least CPU loaded runtime according to the last monitoring"""
+
+    def select(self, runtimes: list[Runtime]) -> Runtime:
+        return min(runtimes, key=lambda runtime: runtime.cpu)
+
+
+class PowerOfTwoChoicesLoadBalancer(LoadBalancer):
+    """Least busy of two random runtimes. Avoids every request landing on the same runtime between
+    monitoring intervals while still favouring the less loaded ones.
+    """
+
+    def select(self, runtimes: list[Runtime]) -> Runtime:
+        if len(runtimes) < 2:
+            return runtimes[0]
+
+        candidates = random.sample(runtimes, 2)
+        outstanding = self.load(candidates)
+
+        return min(candidates, key=lambda runtime: (outstanding[runtime.vm_id], runtime.cpu))
+
+
+class LeastOutstandingLoadBalancer(LoadBalancer):
+    """Runtime with the fewest executions in flight from this worker, ties are broken randomly"""
+
+    def select(self, runtimes: list[Runtime]) -> Runtime:
+        outstanding = self.load(runtimes)
+        least = min(outstanding.values())
+
+        return random.choice([runtime for runtime in runtimes if outstanding[runtime.vm_id] == least])
+
+
+class WeightedRoundRobinLoadBalancer(LoadBalancer):
+    """Smooth weighted round robin. Runtimes are weighted by their idle CPU percentage, so every runtime
+    receives requests and idle ones receive proportionally more. Each set of candidates, usually the
+    runtimes of a flavour, takes its own turns.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # set of candidate VM IDs -> current weight of each of them
+        self.current: OrderedDict[frozenset[int], dict[int, float]] = OrderedDict()
+
+    def select(self, runtimes: list[Runtime]) -> Runtime:
+        candidates = frozenset(runtime.vm_id for runtime in runtimes)
+        total = 0
+        selected = None
+
+        with self.lock:
+            # a set changes when runtimes come or go, starting its turns again
+            current = self.current.setdefault(candidates, {})
+            self.current.move_to_end(candidates)
+
+            while len(self.current) > MAX_CANDIDATE_SETS:
+                self.current.popitem(last=False)
+
+            for runtime in runtimes:
+                weight = max(1, 100 - runtime.cpu)
+                total += weight
+
+                current[runtime.vm_id] = current.get(runtime.vm_id, 0) + weight
+
+                if selected is None or current[runtime.vm_id] > current[selected.vm_id]:
+                    selected = runtime
+
+            current[selected.vm_id] -= total
+
+        return selected
+
+
+LOAD_BALANCERS = {
+    'cpu': CPULoadBalancer,
+    'power_of_two': PowerOfTwoChoicesLoadBalancer,
+    'least_outstanding': LeastOutstandingLoadBalancer,
+    'weighted_round_robin': WeightedRoundRobinLoadBalancer
+}
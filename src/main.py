@@ -1,29 +1,236 @@
 #!/usr/bin/env python
 
 from fastapi import FastAPI, status, HTTPException, Header, Path, Query
-from fastapi.responses import RedirectResponse
-from typing import Annotated
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import StringConstraints
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, Iterator
 import uvicorn
+import asyncio
+import json
 import logging
-import signal
+import time
 
 import cognit_conf as conf
 import biscuit_token as auth
 from cognit_models import ExecutionMode
 import cognit_broker
+import cognit_async_broker
 import opennebula
+import serverless_runtime
+import metrics
+import health
+import wire
+from cache import TTLCache
+from admission import AdmissionController
+from device_metrics import DeviceMetrics
+from object_store import ObjectStore
+from function_code import FunctionCodeStore
+from result_cache import ResultCache
+from singleflight import SingleFlight
 
-TIMEOUT = 30
+TIMEOUT_TITLE = "Seconds to wait for a synchronous execution"
+MEMOIZE_TITLE = "Reuse the cached result of a synchronous execution with the same function and parameters"
+STREAM_KEEPALIVE = 15  # seconds between keep-alive comments of idle result streams
+REQUEST_ID_PATTERN = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+ERROR_POLLS = "Too many requests waiting for execution results"
+
+RequestId = Annotated[str, StringConstraints(pattern=REQUEST_ID_PATTERN)]
 
 logger = logging.getLogger("uvicorn")
 if conf.LOG_LEVEL == 'debug':  # uvicorn run log parameter is ignored
     logger.setLevel(logging.DEBUG)
 
+metrics.ENABLED = conf.METRICS
+
 # biscuit auth
 auth.KEY_PATH = f'{conf.COGNIT_FRONTEND}/v1/public_key'
-auth.load_key()
+auth.REFRESH_INTERVAL = conf.KEY_REFRESH_INTERVAL
+auth.REFRESH_MIN_INTERVAL = conf.KEY_REFRESH_MIN_INTERVAL
+auth.GRACE_PERIOD = conf.KEY_GRACE_PERIOD
+auth.logger = logger
+
+if conf.TOKEN_CACHE_TTL > 0:
+    auth.TOKEN_CACHE = TTLCache(
+        ttl=conf.TOKEN_CACHE_TTL, size=conf.TOKEN_CACHE_SIZE)
+
+if conf.DOCUMENT_CACHE_TTL > 0:
+    opennebula.DOCUMENT_CACHE = TTLCache(
+        ttl=conf.DOCUMENT_CACHE_TTL, size=conf.DOCUMENT_CACHE_SIZE)
+
+# OpenNebula clients reused by requests of the same user
+one_pool = opennebula.OpenNebulaClientPool(
+    oned=conf.ONE_XMLRPC, oneflow=conf.ONEFLOW, logger=logger, size=conf.ONE_CLIENT_POOL_SIZE)
+
+# direct offloads to the Serverless Runtimes of the cluster
+serverless_runtime.logger = logger
+serverless_runtime.CLUSTER_ID = conf.CLUSTER_ID
+serverless_runtime.set_load_balancer(conf.LOAD_BALANCER)
+serverless_runtime.CONNECT_TIMEOUT = conf.OFFLOAD_CONNECT_TIMEOUT
+serverless_runtime.READ_TIMEOUT = conf.OFFLOAD_READ_TIMEOUT
+serverless_runtime.MAX_CONNECTIONS = conf.OFFLOAD_CONNECTIONS
+serverless_runtime.POOL_TIMEOUT = conf.OFFLOAD_POOL_TIMEOUT
+
+if conf.RUNTIME_INDEX:
+    # the index lists the runtimes of every flavour, so it reads oned and oneflow as the service user
+    one_username, one_password = opennebula.get_one_auth()
+
+    serverless_runtime.one = opennebula.OpenNebulaClient(
+        oned=conf.ONE_XMLRPC, oneflow=conf.ONEFLOW, username=one_username, password=one_password, logger=logger)
+
+# broker connections shared by every request handled by this worker
+broker_pool = cognit_broker.BrokerPool(
+    endpoint=conf.BROKER, logger=logger, size=conf.BROKER_POOL_SIZE)
+
+# broker connections and threads of result streams, kept apart so long lived streams cannot starve executions
+stream_pool = cognit_broker.BrokerPool(
+    endpoint=conf.BROKER, logger=logger, size=conf.STREAM_LIMIT, timeout=0)
+stream_threads = ThreadPoolExecutor(max_workers=conf.STREAM_LIMIT, thread_name_prefix="result-stream")
+
+# requests waiting for asynchronous results, on threads and connections of their own so they cannot starve executions
+poll_slots = asyncio.Semaphore(conf.POLL_LIMIT)
+poll_threads = ThreadPoolExecutor(max_workers=conf.POLL_LIMIT, thread_name_prefix="result-poll")
+poll_pool = cognit_broker.BrokerPool(
+    endpoint=conf.BROKER, logger=logger, size=conf.POLL_LIMIT, timeout=0)
+
+# single reply queue receiving the execution results of this worker
+dispatcher = None
+if conf.REPLY_QUEUE == 'shared':
+    dispatcher = cognit_broker.ResultDispatcher(endpoint=conf.BROKER, logger=logger)
+
+cognit_broker.RESULT_TTL = conf.RESULT_TTL
+cognit_broker.WIRE_FORMATS = {flavour: wire.CONTENT_TYPES[wire_format]
+                              for flavour, wire_format in conf.WIRE_FORMATS.items()}
+
+# rejects executions of saturated flavours
+admission = None
+if conf.MAX_IN_FLIGHT > 0 or conf.MAX_QUEUE_DEPTH > 0:
+    admission = AdmissionController(logger=logger,
+                                    max_in_flight=conf.MAX_IN_FLIGHT,
+                                    max_queue_depth=conf.MAX_QUEUE_DEPTH,
+                                    depth_ttl=conf.QUEUE_DEPTH_TTL,
+                                    retry_after=conf.RETRY_AFTER)
+
+# bucket holding the parameters and results too long for the broker
+object_store = None
+if conf.OBJECT_STORE:
+    object_store = ObjectStore(logger=logger,
+                               endpoint=conf.OBJECT_STORE,
+                               access_key=conf.OBJECT_STORE_ACCESS_KEY,
+                               secret_key=conf.OBJECT_STORE_SECRET_KEY,
+                               bucket=conf.OBJECT_STORE_BUCKET,
+                               threshold=conf.OBJECT_STORE_THRESHOLD,
+                               url_ttl=conf.OBJECT_STORE_URL_TTL,
+                               retention=conf.OBJECT_STORE_RETENTION)
+
+# code of the functions executed by hash, downloaded from the object store by the SRs that do not have it yet
+function_code = None
+if conf.FUNCTION_CODE == 'hash':
+    if object_store is None:
+        logger.warning("Function code by hash requires an object store. Sending it inline.")
+    else:
+        function_code = FunctionCodeStore(
+            object_store=object_store, ttl=conf.FUNCTION_CODE_TTL, size=conf.FUNCTION_CODE_SIZE)
+
+result_cache = None
+if conf.RESULT_CACHE_TTL > 0:
+    result_cache = ResultCache(ttl=conf.RESULT_CACHE_TTL, size=conf.RESULT_CACHE_SIZE)
+
+# synchronous executions opting into the result cache join identical executions in flight
+execution_flights = SingleFlight()
+
+# recent metrics observed by devices
+device_metrics = DeviceMetrics(logger=logger,
+                               size=conf.DEVICE_METRICS_SIZE,
+                               devices=conf.DEVICE_METRICS_DEVICES,
+                               user_devices=conf.DEVICE_METRICS_USER_DEVICES,
+                               flavours=conf.DEVICE_METRICS_FLAVOURS,
+                               rate_window=conf.DEVICE_METRICS_RATE_WINDOW,
+                               flush_interval=conf.DEVICE_METRICS_FLUSH_INTERVAL,
+                               broker_pool=broker_pool)
+
+# executions awaited on the event loop instead of a threadpool thread
+async_broker = None
+if conf.EXECUTION_BACKEND == 'asyncio':
+    async_broker = cognit_async_broker.AsyncBrokerClient(endpoint=conf.BROKER, logger=logger)
+
+
+async def probe_public_key():
+    await run_in_threadpool(auth.probe_key)
+
+
+async def probe_broker():
+    await run_in_threadpool(broker_pool.check)
+
+    # synchronous executions use their own connection with the asyncio backend
+    if async_broker is not None:
+        await async_broker.connect()
+
+
+async def probe_object_store():
+    await run_in_threadpool(object_store.check)
+
+
+probes = {
+    'oned': lambda: health.probe_endpoint(conf.ONE_XMLRPC),
+    'oneflow': lambda: health.probe_endpoint(conf.ONEFLOW),
+    'cognit_frontend': probe_public_key,
+    'broker': probe_broker
+}
+if object_store is not None:
+    probes['object_store'] = probe_object_store
+
+# dependencies probed in the background, requests are answered with 503 until those they need are reachable.
+# oneflow is only used by direct offloads and just reported
+readiness = health.Readiness(logger=logger,
+                             probes=probes,
+                             interval=conf.READINESS_INTERVAL,
+                             timeout=conf.READINESS_TIMEOUT,
+                             optional=['oneflow'])
+
+# dependencies needed by each kind of request
+EXECUTION_DEPENDENCIES = ('cognit_frontend', 'oned', 'broker', 'object_store')
+RESULT_DEPENDENCIES = ('cognit_frontend', 'broker')
+DEVICE_METRICS_DEPENDENCIES = ('cognit_frontend',)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.start()
+    auth.start_key_refresher()
+
+    if dispatcher is not None:
+        dispatcher.start()
+
+    device_metrics.start()
 
-app = FastAPI(title='Edge Cluster Frontend', version='0.1.0')
+    if conf.RUNTIME_INDEX:
+        serverless_runtime.start_runtime_index(conf.RUNTIME_INDEX_INTERVAL)
+
+    yield
+
+    await readiness.stop()
+    auth.stop_key_refresher()
+    device_metrics.stop()
+    serverless_runtime.stop_runtime_index()
+
+    if dispatcher is not None:
+        dispatcher.stop()
+
+    if async_broker is not None:
+        await async_broker.close()
+
+    broker_pool.close()
+    stream_pool.close()
+    stream_threads.shutdown(wait=False)
+    poll_threads.shutdown(wait=False)
+    poll_pool.close()
+    serverless_runtime.close_http_session()
+
+
+app = FastAPI(title='Edge Cluster Frontend', version='0.1.0', lifespan=lifespan)
 
 
 @app.get("/")
@@ -32,82 +239,343 @@ async def root():
 
 
 @app.post("/v1/functions/{id}/execute", status_code=status.HTTP_200_OK)
-def execute_function(
+async def execute_function(
     id: Annotated[int, Path(title="Document ID of the Function")],
     parameters: list[str],
     app_req_id: Annotated[int, Query(title="Document ID of the App Requirement")],
     mode: Annotated[ExecutionMode, Query(title="Execution Mode")],
+    timeout: Annotated[float | None, Query(title=TIMEOUT_TITLE, gt=0, le=conf.EXECUTION_TIMEOUT_LIMIT)] = None,
+    request_timeout: Annotated[float | None, Header(title=TIMEOUT_TITLE, gt=0, le=conf.EXECUTION_TIMEOUT_LIMIT)] = None,
+    memoize: Annotated[bool, Header(title=MEMOIZE_TITLE)] = False,
     token: Annotated[str | None, Header()] = None
 ) -> dict:
+    deadline = execution_deadline(mode, timeout or request_timeout)
+
+    credentials = await run_in_threadpool(authorize, token, EXECUTION_DEPENDENCIES)
+
+    # client for reading function related documents
+    one_client = one_pool.get(username=credentials[0], password=credentials[1])
 
-    credentials = authorize(token)
+    results = await execute(one_client, id, app_req_id, [parameters], mode, deadline, memoize)
 
-    # create client for reading function related documents
-    one_client = opennebula.OpenNebulaClient(
-        oned=conf.ONE_XMLRPC, oneflow=conf.ONEFLOW, username=credentials[0], password=credentials[1], logger=logger)
+    if mode == ExecutionMode.ASYNC:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=results[0])
 
-    # Create a new BrokerClient per request for thread safety
-    broker_client = cognit_broker.BrokerClient(endpoint=conf.BROKER, logger=logger)
+    return cognit_broker.result_message(results[0])
 
-    executioner = cognit_broker.Executioner(
-        broker_client=broker_client, one_client=one_client)
 
-    # Let nginx handle the timeouts. 60 seconds is the default
-    result = executioner.execute_function(function_id=id,
-                                          app_req_id=app_req_id,
-                                          parameters=parameters,
-                                          mode=mode.value)
+@app.post("/v1/functions/{id}/execute_batch", status_code=status.HTTP_200_OK)
+async def execute_function_batch(
+    id: Annotated[int, Path(title="Document ID of the Function")],
+    parameter_sets: list[list[str]],
+    app_req_id: Annotated[int, Query(title="Document ID of the App Requirement")],
+    mode: Annotated[ExecutionMode, Query(title="Execution Mode")],
+    timeout: Annotated[float | None, Query(title=TIMEOUT_TITLE, gt=0, le=conf.EXECUTION_TIMEOUT_LIMIT)] = None,
+    request_timeout: Annotated[float | None, Header(title=TIMEOUT_TITLE, gt=0, le=conf.EXECUTION_TIMEOUT_LIMIT)] = None,
+    memoize: Annotated[bool, Header(title=MEMOIZE_TITLE)] = False,
+    token: Annotated[str | None, Header()] = None
+) -> list[dict]:
+    """Execute a function once per set of parameters. Results keep the order of the parameter sets,
+    each one with the code and message of its execution.
+    """
+    if len(parameter_sets) > conf.BATCH_SIZE_LIMIT:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Batches are limited to {conf.BATCH_SIZE_LIMIT} executions")
 
-    return result
+    deadline = execution_deadline(mode, timeout or request_timeout)
 
+    credentials = await run_in_threadpool(authorize, token, EXECUTION_DEPENDENCIES)
 
-# What to do with these metrics
-@app.post("/v1/device_metrics", status_code=status.HTTP_200_OK)
-def upload_client_metrics(
-    metrics: dict,
+    one_client = one_pool.get(username=credentials[0], password=credentials[1])
+
+    results = await execute(one_client, id, app_req_id, parameter_sets, mode, deadline, memoize)
+
+    if mode == ExecutionMode.ASYNC:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=results)
+
+    return results
+
+
+@app.get("/v1/executions/stream", status_code=status.HTTP_200_OK)
+async def stream_executions(
+    request_id: Annotated[list[RequestId], Query(title="Request IDs of asynchronous executions")],
     token: Annotated[str | None, Header()] = None
-):
+) -> StreamingResponse:
+    """Server-Sent Events stream sending the result of each asynchronous execution as soon as it is ready.
+    Executions still running when the stream times out are sent as status events.
+    """
+    if len(request_id) > conf.BATCH_SIZE_LIMIT:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Streams are limited to {conf.BATCH_SIZE_LIMIT} executions")
 
-    authorize(token)
+    credentials = await run_in_threadpool(authorize, token, RESULT_DEPENDENCIES)
 
+    events = stream_results(list(dict.fromkeys(request_id)), owner=credentials[0])
 
-def authorize(token) -> list[str]:
-    if token is None:
-        message = 'Missing token in header'
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail=message)
+    # Borrow the broker connection before responding, so errors keep their status code
+    first = await run_in_threadpool(next, events)
 
-    try:
-        return auth.authorize_token(token)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+    return StreamingResponse(read_stream(first, events), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/v1/executions/{request_id}", status_code=status.HTTP_200_OK)
+async def get_execution(
+    request_id: Annotated[str, Path(title="Request ID of an asynchronous execution", pattern=REQUEST_ID_PATTERN)],
+    wait: Annotated[float, Query(title="Seconds to wait for the result", ge=0, le=conf.RESULT_WAIT_LIMIT)] = 0,
+    token: Annotated[str | None, Header()] = None
+) -> dict:
+    """Result of an asynchronous execution. Responds 202 with the execution status while it is running.
+    The result can be read until it has not been requested for result_ttl seconds, only by the user
+    that requested the execution.
+    """
+    credentials = await run_in_threadpool(authorize, token, RESULT_DEPENDENCIES)
+
+    queue = cognit_broker.result_queue(request_id, owner=credentials[0])
+
+    if wait > 0:
+        result = await wait_result(queue, wait)
+    else:
+        result = await run_in_threadpool(peek_result, broker_pool, queue)
+
+    if result is None:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=execution_status(request_id))
 
+    return cognit_broker.result_message(result)
 
-def with_timeout(func: callable, *args, **kwargs):
-    """Handle timeouts according to specified timer
 
-    Args:
-        func (callable): The function that might time out
+async def wait_result(queue: str, wait: float) -> dict | None:
+    """Wait for the result of an asynchronous execution on a thread and connection reserved for polls
+
+    Raises:
+        HTTPException: 503 if poll_limit requests are already waiting
+    """
+    if poll_slots.locked():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_POLLS)
+
+    async with poll_slots:
+        return await asyncio.get_running_loop().run_in_executor(poll_threads, peek_result, poll_pool, queue, wait)
+
+
+def peek_result(pool: cognit_broker.BrokerPool, queue: str, wait: float = 0) -> dict | None:
+    with pool.borrow() as broker_client:
+        return broker_client.peek_message(queue=queue, timeout=wait)
+
+
+async def execute(one_client: opennebula.OpenNebulaClient, id: int, app_req_id: int,
+                  parameter_sets: list[list[str]], mode: ExecutionMode, deadline: float | None,
+                  memoize: bool = False) -> list[dict]:
+    """Run one execution per set of parameters
 
     Returns:
-        _type_: Whatever the function returns
+        list[dict]: Results of the executions, or their status if they run asynchronously
     """
-    # Protect vs possible execution timeouts
-    signal.signal(signal.SIGALRM, _timeout_handler)
-    signal.alarm(TIMEOUT)
+    if async_broker is None:
+        return await run_in_threadpool(execute_blocking, one_client, id, app_req_id, parameter_sets, mode,
+                                      deadline, memoize)
+
+    executioner = cognit_async_broker.AsyncExecutioner(
+        broker_client=async_broker, one_client=one_client, deadline=deadline, admission=admission,
+        object_store=object_store, function_code=function_code, result_cache=result_cache,
+        flights=execution_flights)
+
+    request_ids = await executioner.submit_batch(function_id=id,
+                                                 app_req_id=app_req_id,
+                                                 parameter_sets=parameter_sets,
+                                                 mode=mode.value,
+                                                 memoize=memoize)
+
+    if mode == ExecutionMode.ASYNC:
+        return [execution_status(request_id) for request_id in request_ids]
+
+    return await executioner.collect_results(request_ids)
+
+
+def execute_blocking(one_client: opennebula.OpenNebulaClient, id: int, app_req_id: int,
+                     parameter_sets: list[list[str]], mode: ExecutionMode, deadline: float | None,
+                     memoize: bool = False) -> list[dict]:
+    # Borrow a pooled BrokerClient, each one is used by a single thread at a time
+    with broker_pool.borrow() as broker_client:
+        executioner = cognit_broker.Executioner(broker_client=broker_client,
+                                                one_client=one_client,
+                                                dispatcher=dispatcher,
+                                                deadline=deadline,
+                                                admission=admission,
+                                                object_store=object_store,
+                                                function_code=function_code,
+                                                broker_pool=broker_pool,
+                                                result_cache=result_cache,
+                                                flights=execution_flights)
+
+        request_ids = executioner.submit_batch(function_id=id,
+                                               app_req_id=app_req_id,
+                                               parameter_sets=parameter_sets,
+                                               mode=mode.value,
+                                               memoize=memoize)
+
+        if mode == ExecutionMode.ASYNC:
+            return [execution_status(request_id) for request_id in request_ids]
+
+        if dispatcher is None:
+            # The temporary results queues only exist on the connection that declared them
+            return executioner.collect_results(request_ids)
+
+    # Results are routed by the dispatcher, the broker connection is not needed while waiting
+    return executioner.collect_results(request_ids)
+
+
+async def read_stream(first: str, events: Iterator[str]) -> AsyncIterator[str]:
+    """Events of a result stream, read on the threads reserved for streams. One per stream_pool
+    connection, so a stream never waits for a thread.
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
 
     try:
-        return func(*args, **kwargs)
+        yield first
+
+        while True:
+            pending = loop.run_in_executor(stream_threads, next, events, None)
+            event = await pending
+
+            if event is None:
+                break
+
+            yield event
     finally:
-        signal.alarm(0)  # Cancel the timeout
+        # a generator cannot be closed while it runs, let the read in progress of a cancelled stream end
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+
+        await loop.run_in_executor(stream_threads, events.close)
+
+
+def stream_results(request_ids: list[str], owner: str) -> Iterator[str]:
+    """Server-Sent Events with the results of the asynchronous executions of a user, in the order they are ready"""
+    queues = {cognit_broker.result_queue(request_id, owner): request_id for request_id in request_ids}
+    pending = set(request_ids)
+
+    with stream_pool.borrow() as broker_client:
+        yield f": waiting for {len(pending)} execution(s)\n\n"
+
+        for event in broker_client.stream_messages(list(queues), timeout=conf.STREAM_TIMEOUT,
+                                                   idle_interval=STREAM_KEEPALIVE):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            queue, result = event
+            request_id = queues[queue]
+            pending.discard(request_id)
+
+            if result is None:
+                result = {"code": status.HTTP_404_NOT_FOUND,
+                          "message": cognit_broker.ERROR_EXECUTION_NOT_FOUND}
+
+            yield server_sent_event("result", request_id, {"request_id": request_id, **result})
+
+    for request_id in request_ids:
+        if request_id in pending:
+            yield server_sent_event("status", request_id, execution_status(request_id))
+
+
+def server_sent_event(event: str, id: str, data: dict) -> str:
+    return f"event: {event}\nid: {id}\ndata: {json.dumps(data)}\n\n"
+
+
+def execution_deadline(mode: ExecutionMode, timeout: float | None) -> float | None:
+    """time.monotonic() value after which a synchronous execution is abandoned. Asynchronous executions
+    are not waited for and have no deadline.
+    """
+    if mode == ExecutionMode.ASYNC:
+        return None
+
+    if timeout is None:
+        if conf.EXECUTION_TIMEOUT <= 0:
+            return None
+
+        timeout = conf.EXECUTION_TIMEOUT
+
+    return time.monotonic() + timeout
+
+
+def execution_status(request_id: str) -> dict:
+    return {"request_id": request_id, "status": "WORKING"}
+
+
+@app.get("/healthz", status_code=status.HTTP_200_OK)
+async def get_health() -> dict:
+    """Liveness of the service, along with the state of its dependencies"""
+    return readiness.status()
+
+
+@app.get("/readyz", status_code=status.HTTP_200_OK)
+async def get_readiness() -> dict:
+    """State of the dependencies of the service. Responds 503 until all but the optional ones are reachable"""
+    if not readiness.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=readiness.status())
+
+    return readiness.status()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Latency histograms of this worker in Prometheus text format"""
+    if not metrics.ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+
+    text = metrics.render()
+
+    if result_cache is not None:
+        text += result_cache.render()
+
+    text += '\n'.join(metrics.sample('cognit_coalesced_executions_total',
+                                     'Executions answered by an identical execution in flight',
+                                     'counter', execution_flights.shared)) + '\n'
+
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.post("/v1/device_metrics", status_code=status.HTTP_200_OK)
+def upload_client_metrics(
+    metrics: dict,
+    token: Annotated[str | None, Header()] = None
+):
+    """Store the metrics observed by a device. Numeric values, or lists of them, are samples of the
+    metric named by their key. Optional device_id and flavour keys identify the device and the
+    flavour the samples relate to.
+    """
+    credentials = authorize(token, DEVICE_METRICS_DEPENDENCIES)
+
+    device_metrics.ingest(user=credentials[0], metrics=metrics)
+
+
+@app.get("/v1/device_metrics", status_code=status.HTTP_200_OK)
+def get_client_metrics(
+    device_id: Annotated[str | None, Query(title="Device of the user to summarize")] = None,
+    token: Annotated[str | None, Header()] = None
+) -> dict:
+    """Percentiles, last value and rate of the recent samples of each metric, by device of the user"""
+    credentials = authorize(token, DEVICE_METRICS_DEPENDENCIES)
+
+    return device_metrics.summary(user=credentials[0], device_id=device_id)
+
+
+def authorize(token, dependencies: tuple[str, ...]) -> list[str]:
+    readiness.require(dependencies)
 
+    with metrics.AUTHORIZATION.time():
+        if token is None:
+            message = 'Missing token in header'
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=message)
 
-def _timeout_handler(signum, frame):
-    raise HTTPException(
-        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-        detail="Function execution timed out"
-    )
+        try:
+            return auth.authorize_token(token)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
 
 
 if __name__ == "__main__":
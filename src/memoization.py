@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+from fastapi import HTTPException, status
+import uuid
+
+from cognit_models import ExecutionMode
+from result_cache import ResultCache, memoized, result_key
+from singleflight import SingleFlight
+
+
+class Memoization:
+    """Bookkeeping of the executions of an executioner opting into the result cache. Each one is
+    answered from the cache, joins an identical execution in flight or is published, in which case its
+    result is cached and handed to the executions that joined it. Both execution backends share it and
+    only differ in how they publish executions and wait for them.
+    """
+
+    def __init__(self, result_cache: ResultCache = None, flights: SingleFlight = None):
+        """
+        Args:
+            result_cache (ResultCache, optional): Results of deterministic functions reused by
+                synchronous executions opting into it. Defaults to executing every request.
+            flights (SingleFlight, optional): Executions in flight, joined by identical synchronous
+                executions opting into the result cache. Defaults to executing every request.
+        """
+        self.result_cache = result_cache
+        self.flights = flights
+        self.cached: dict[str, dict] = {}  # results found in the cache, by the request ID given to them
+        self.result_keys: dict[str, tuple[str, str]] = {}  # key of the results to cache and share
+        # identical executions in flight, with the key, request and flavour to run them again, by the request ID
+        # given to them
+        self.following: dict[str, tuple[Future, tuple[str, str], dict, str]] = {}
+
+    def applies(self, mode: str, memoize: bool, requirement: dict) -> bool:
+        """Whether executions are memoized, only synchronous ones opting in are"""
+        if self.result_cache is None and self.flights is None:
+            return False
+
+        return mode != ExecutionMode.ASYNC and (memoize or memoized(requirement))
+
+    def plan(self, function: dict, parameter_sets: list[list[str]], execution_requests: list[dict],
+             flavour: str) -> tuple[list[str], list[tuple[str, str]], list[int]]:
+        """Give a request ID to every execution, answering it from the cache or joining it to an identical
+        execution in flight when possible
+
+        Returns:
+            tuple[list[str], list[tuple[str, str]], list[int]]: Request IDs and result keys of the
+                executions, and the indexes of those to publish
+        """
+        request_ids = [str(uuid.uuid4()) for _ in parameter_sets]
+        keys = [result_key(function["FC"], parameters) for parameters in parameter_sets]
+        missing = []
+
+        for index, (request_id, key) in enumerate(zip(request_ids, keys)):
+            result = self.result_cache.get(key) if self.result_cache is not None else None
+
+            if result is not None:
+                self.cached[request_id] = result
+                continue
+
+            if self.flights is not None:
+                flight, leader = self.flights.join(key)
+
+                if not leader:
+                    self.following[request_id] = (flight, key, execution_requests[index], flavour)
+                    continue
+
+            missing.append(index)
+
+        return request_ids, keys, missing
+
+    def published(self, keys: list[tuple[str, str]], request_ids: list[str]):
+        """Record the result keys of published executions"""
+        self.result_keys.update(zip(request_ids, keys))
+
+    def rejoin(self, key: tuple[str, str]) -> Future | None:
+        """Join the next identical execution in flight once the joined one ended without result
+
+        Returns:
+            Future | None: The execution joined, None if the caller has to publish it
+        """
+        flight, leader = self.flights.join(key)
+
+        return None if leader else flight
+
+    def land(self, key: tuple[str, str] | None, result: dict = None, error: BaseException = None):
+        """Cache the result of an execution, and hand it to the identical executions that joined it.
+        Only failures of the SR or the broker are handed to them, without result they run it themselves.
+        """
+        if key is None:
+            return
+
+        if result is not None and self.result_cache is not None:
+            self.result_cache.set(key, result)
+
+        if self.flights is not None:
+            self.flights.land(key, result, error if error is not None and shared_error(error) else None)
+
+    def answered(self, request_id: str) -> bool:
+        """Forget an execution answered without being published, whether it was"""
+        return self.cached.pop(request_id, None) is not None or self.following.pop(request_id, None) is not None
+
+    def forget(self, request_id: str):
+        """Forget an execution, releasing the executions that joined it if it was still awaited"""
+        self.answered(request_id)
+        self.land(self.result_keys.pop(request_id, None))
+
+
+def shared_error(error: BaseException) -> bool:
+    """Whether the failure of an execution is handed to the identical executions joined to it. Those
+    are only failures of the SR or the broker, an execution running out of time or cancelled lets the
+    joined ones run it themselves.
+    """
+    if not isinstance(error, Exception):
+        return False
+
+    return not (isinstance(error, HTTPException) and error.status_code == status.HTTP_504_GATEWAY_TIMEOUT)
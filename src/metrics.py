@@ -0,0 +1,174 @@
+from fastapi import HTTPException
+from typing import Iterable
+import bisect
+import threading
+import time
+
+ENABLED = False  # metrics are only recorded when enabled
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+MAX_LABEL_VALUES = 100  # distinct values of a capped label, later ones are folded into OTHER
+OTHER = 'other'
+
+
+class Histogram:
+    """Prometheus histogram of durations, one series per combination of label values. Labels taking
+    values from requests are capped, so they cannot create series without bound.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str], buckets: tuple = BUCKETS,
+                 capped: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = buckets
+
+        # values seen by index of each capped label
+        self.seen: dict[int, set[str]] = {self.labels.index(label): set() for label in capped}
+
+        # label values -> [count per bucket and +Inf, sum]
+        self.series: dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+        HISTOGRAMS.append(self)
+
+    def observe(self, value: float, **labels):
+        values = [str(labels.get(label, '')) for label in self.labels]
+        bucket = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            for index, seen in self.seen.items():
+                if values[index] not in seen:
+                    if len(seen) < MAX_LABEL_VALUES:
+                        seen.add(values[index])
+                    else:
+                        values[index] = OTHER
+
+            key = tuple(values)
+            series = self.series.get(key)
+
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            series[0][bucket] += 1
+            series[1] += value
+
+    def time(self, start: float = None, **labels) -> 'Timer':
+        """Context measuring the duration of its block. The outcome label is set from the exception
+        leaving the block, unless set explicitly.
+
+        Args:
+            start (float, optional): time.perf_counter() value to measure from instead of the start
+                of the block
+        """
+        if not ENABLED:
+            return NULL_TIMER
+
+        return Timer(self, labels, start)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+
+        for key, counts, total in sorted(series):
+            labels = [f'{label}="{escape(value)}"' for label, value in zip(self.labels, key)]
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+
+            labels = ','.join(labels)
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+
+        return lines
+
+
+class Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: dict, start: float = None):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = start
+
+    def label(self, **labels):
+        """Set labels only known once the block has started"""
+        self.labels.update(labels)
+
+    def __enter__(self) -> 'Timer':
+        if self.start is None:
+            self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if 'outcome' not in self.labels:
+            self.labels['outcome'] = outcome(value)
+
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class NullTimer:
+    """Timer used while metrics are disabled"""
+
+    def label(self, **labels):
+        pass
+
+    def __enter__(self) -> 'NullTimer':
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+def outcome(error: BaseException | None) -> str:
+    """ok on success, the status code of HTTP errors and error otherwise"""
+    if error is None:
+        return 'ok'
+
+    if isinstance(error, HTTPException):
+        return str(error.status_code)
+
+    return 'error'
+
+
+def escape(value: str) -> str:
+    """Label value escaped for the Prometheus text exposition format"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render() -> str:
+    """Every histogram in Prometheus text exposition format"""
+    lines = []
+
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+def sample(name: str, documentation: str, kind: str, value: float) -> list[str]:
+    """Single unlabelled counter or gauge in Prometheus text exposition format"""
+    return [f"# HELP {name} {documentation}",
+            f"# TYPE {name} {kind}",
+            f"{name} {value}"]
+
+
+HISTOGRAMS: list[Histogram] = []
+NULL_TIMER = NullTimer()
+
+AUTHORIZATION = Histogram('cognit_authorization_seconds',
+                          'Time spent verifying and authorizing biscuit tokens', ['outcome'])
+DOCUMENT_READ = Histogram('cognit_document_read_seconds',
+                          'Time spent reading OpenNebula documents', ['type', 'source', 'outcome'])
+EXECUTION_REQUEST = Histogram('cognit_execution_request_seconds',
+                              'Time spent declaring result queues and publishing execution requests',
+                              ['flavour', 'mode', 'outcome'], capped=['flavour'])
+EXECUTION_WAIT = Histogram('cognit_execution_wait_seconds',
+                           'Time from publishing an execution request until its result is received',
+                           ['flavour', 'outcome'], capped=['flavour'])
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from fastapi import HTTPException, status
+from minio import Minio
+from minio.commonconfig import ENABLED, Filter
+from minio.lifecycleconfig import Expiration, LifecycleConfig, Rule
+from urllib.parse import urlparse
+import hashlib
+import io
+import logging
+
+REGION = 'us-east-1'  # URLs are presigned for a known region, which saves a region lookup per URL
+CONTENT_TYPE = 'text/plain'  # parameters and results are base64 encoded
+ERROR_UPLOAD = "Execution parameters could not be stored"
+
+
+class ObjectStore:
+    """S3 compatible bucket holding the parameters and results too large to travel through the broker.
+
+    Parameters longer than the threshold are uploaded and replaced in the execution request by a
+    reference with the object key, its SHA-256 and a presigned URL the SR downloads it from. Every
+    execution request also carries presigned URLs for its result, so the SR can upload results longer
+    than the threshold and publish a reference instead, which reaches the device as is.
+    """
+
+    def __init__(self, logger: logging.Logger, endpoint: str, access_key: str, secret_key: str, bucket: str,
+                 threshold: int, url_ttl: int, retention: int):
+        """
+        Args:
+            endpoint (str): URL of the object store, reachable by devices and SRs
+            threshold (int): Length in bytes above which parameters and results are stored in the bucket
+            url_ttl (int): Seconds presigned URLs are valid for
+            retention (int): Days objects are kept before the bucket deletes them
+        """
+        url = urlparse(endpoint)
+
+        self.client = Minio(url.netloc, access_key=access_key, secret_key=secret_key,
+                            secure=url.scheme == 'https', region=REGION)
+        self.logger = logger
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.threshold = threshold
+        self.url_ttl = timedelta(seconds=url_ttl)
+        self.retention = retention
+        self.configured = False
+
+    def check(self):
+        """Ensure the bucket exists, creating it with its retention rule the first time
+
+        Raises:
+            Exception: If the object store cannot be reached or the bucket does not exist
+        """
+        if self.configured:
+            if not self.client.bucket_exists(self.bucket):
+                raise Exception(f"Bucket {self.bucket} does not exist")
+            return
+
+        if not self.client.bucket_exists(self.bucket):
+            self.client.make_bucket(self.bucket)
+            self.logger.info(f"Created bucket {self.bucket} at {self.endpoint}")
+
+        rule = Rule(ENABLED, rule_filter=Filter(prefix=''), rule_id='expire-executions',
+                    expiration=Expiration(days=self.retention))
+        self.client.set_bucket_lifecycle(self.bucket, LifecycleConfig([rule]))
+
+        self.configured = True
+
+    def offload(self, execution_requests: list[dict]):
+        """Replace the long parameters of execution requests by references to uploaded objects, and add
+        the URLs their results can be uploaded to
+
+        Raises:
+            HTTPException: 503 if a parameter could not be uploaded
+        """
+        for execution_request in execution_requests:
+            request_id = execution_request["request_id"]
+            payload = execution_request["payload"]
+
+            payload["params"] = [self.reference(f"parameters/{request_id}/{index}", param)
+                                 if len(param) > self.threshold else param
+                                 for index, param in enumerate(payload["params"])]
+
+            payload["result_object"] = self.result_object(f"results/{request_id}")
+
+    def reference(self, key: str, value: str) -> dict:
+        """Upload a value and reference it"""
+        data = self.upload(key, value)
+
+        return {
+            "key": key,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "size": len(data),
+            "url": self.url(key)
+        }
+
+    def upload(self, key: str, value: str) -> bytes:
+        """Upload a value
+
+        Returns:
+            bytes: Uploaded data
+
+        Raises:
+            HTTPException: 503 if the value could not be uploaded
+        """
+        data = value.encode()
+
+        try:
+            self.client.put_object(self.bucket, key, io.BytesIO(data), len(data), content_type=CONTENT_TYPE)
+        except Exception as e:
+            self.logger.error(f"Could not upload {key} to bucket {self.bucket}: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_UPLOAD)
+
+        self.logger.debug(f"Uploaded {len(data)} bytes to {key}")
+
+        return data
+
+    def url(self, key: str) -> str:
+        """Presigned URL to download an object"""
+        return self.client.presigned_get_object(self.bucket, key, expires=self.url_ttl)
+
+    def result_object(self, key: str) -> dict:
+        """Where the SR uploads a result longer than the threshold, and the URL to download it from"""
+        return {
+            "key": key,
+            "threshold": self.threshold,
+            "upload_url": self.client.presigned_put_object(self.bucket, key, expires=self.url_ttl),
+            "url": self.client.presigned_get_object(self.bucket, key, expires=self.url_ttl)
+        }
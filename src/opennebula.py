@@ -1,11 +1,19 @@
 import pyone
 from fastapi import HTTPException, status
+from collections import OrderedDict
+import threading
 import logging
+import hashlib
 import os
 import sys
+import xmlrpc.client
 import requests
 from requests.auth import HTTPBasicAuth
 
+from cache import TTLCache
+from singleflight import SingleFlight
+import metrics
+
 
 # The user doesn't control the SR VMs. These VMs shared among every user should be under the control
 # of an admin of sorts of the Function Executing group. Could also be oneadmin.
@@ -13,6 +21,11 @@ from requests.auth import HTTPBasicAuth
 _home = os.path.expanduser("~")
 ONE_AUTH = f"{_home}/.one/one_auth"
 
+# FUNCTION and APP_REQUIREMENT documents read per user. Disabled when None
+DOCUMENT_CACHE: TTLCache = None
+# concurrent reads of the same document by the same credentials share a single oned call
+DOCUMENT_FLIGHTS = SingleFlight()
+
 
 def get_one_auth() -> str:
     if os.path.exists(ONE_AUTH):
@@ -35,15 +48,29 @@ class OpenNebulaClient(object):
 
     def __init__(self, oned: str, oneflow: str, username: str, password: str, logger: logging.Logger):
         self.oned = oned
+        self.username = username
         self.oneflow_session = {
             'endpoint': oneflow,
             'user': username,
             'pass': password
         }
 
+        # keep-alive HTTP connections reused by every oned and oneflow call of this client
+        self.http = requests.Session()
+
         self.one = pyone.OneServer(oned, session=f"{username}:{password}")
+        # pyone always builds its own transport, which opens a new connection per call
+        transport = KeepAliveTransport(self.http)
+        transport.set_https(oned.startswith('https'))
+        transport.set_https_verify(True)
+        self.one._ServerProxy__transport = transport
+
         self.logger = logger
 
+        # Cached documents are only served to the credentials that could read them from oned
+        self.session_id = (username, hashlib.sha256(
+            password.encode()).hexdigest())
+
     def vm_info(self, vm_id: int) -> dict:
         self.logger.info(f"Getting information about VM {vm_id}")
 
@@ -66,6 +93,35 @@ class OpenNebulaClient(object):
         return self.get_document(document_id=document_id, type_str='APP_REQUIREMENT')
 
     def get_document(self, document_id: int, type_str: str) -> dict:
+        with metrics.DOCUMENT_READ.time(type=type_str, source='oned') as timer:
+            key = (type_str, document_id, self.session_id)
+
+            if DOCUMENT_CACHE is not None:
+                document = DOCUMENT_CACHE.get(key)
+
+                if document is not None:
+                    timer.label(source='cache')
+                    self.logger.debug(f"Document {document_id} read from cache")
+
+                    return dict(document)
+
+            document, shared = DOCUMENT_FLIGHTS.do(key, lambda: self.cache_document(key, document_id, type_str))
+
+            if shared:
+                timer.label(source='coalesced')
+                self.logger.debug(f"Document {document_id} read by a concurrent request")
+
+            return dict(document)
+
+    def cache_document(self, key: tuple, document_id: int, type_str: str) -> dict:
+        document = self.read_document(document_id, type_str)
+
+        if DOCUMENT_CACHE is not None:
+            DOCUMENT_CACHE.set(key, document)
+
+        return document
+
+    def read_document(self, document_id: int, type_str: str) -> dict:
         self.logger.info(f"Getting information about document {document_id}")
         document = _validate_xmlrpc_call(
             lambda: self.one.document.info(document_id))
@@ -87,7 +143,7 @@ class OpenNebulaClient(object):
         uri = f"{self.oneflow_session['endpoint']}/service"
 
         self.logger.info("Getting existing oneflow services")
-        response = requests.get(uri, auth=HTTPBasicAuth(
+        response = self.http.get(uri, auth=HTTPBasicAuth(
             self.oneflow_session['user'], self.oneflow_session['pass']))
 
         if response.status_code != 200:
@@ -104,6 +160,66 @@ class OpenNebulaClient(object):
         return self.one.vmpool.infoextended(-2, -1, -1, 3, f'CID={cluster_id}').VM
 
 
+class KeepAliveTransport(pyone.RequestsTransport):
+    """pyone XMLRPC transport sending requests through a shared requests Session"""
+
+    def __init__(self, session: requests.Session):
+        super().__init__()
+        self.session = session
+
+    def request(self, host, handler, request_body, verbose=False):
+        headers = {'User-Agent': self.user_agent,
+                   'Content-Type': 'text/xml',
+                   'Accept': '*/*'}
+
+        url = self._build_url(host, handler)
+
+        response = self.session.post(url, data=request_body, headers=headers,
+                                     verify=self.https_verify)
+        try:
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise xmlrpc.client.ProtocolError(url, response.status_code,
+                                              str(e), response.headers)
+
+        return self.parse_response(response)
+
+
+class OpenNebulaClientPool:
+    """Bounded set of OpenNebula clients reused across requests of the same user. The least
+    recently used client is dropped when the pool is full.
+    """
+
+    def __init__(self, oned: str, oneflow: str, logger: logging.Logger, size: int):
+        self.oned = oned
+        self.oneflow = oneflow
+        self.logger = logger
+        self.size = size
+
+        self.clients: OrderedDict[tuple[str, str], OpenNebulaClient] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, username: str, password: str) -> OpenNebulaClient:
+        key = (username, hashlib.sha256(password.encode()).hexdigest())
+
+        with self.lock:
+            client = self.clients.get(key)
+
+            if client is not None:
+                self.clients.move_to_end(key)
+                return client
+
+            client = OpenNebulaClient(oned=self.oned, oneflow=self.oneflow,
+                                      username=username, password=password, logger=self.logger)
+            self.clients[key] = client
+
+            # connections of evicted clients are closed once no request uses them
+            while len(self.clients) > self.size:
+                self.clients.popitem(last=False)
+
+            return client
+
+
 def _validate_xmlrpc_call(xmlrpc_call):
     try:
         return xmlrpc_call()
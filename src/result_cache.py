@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import threading
+import time
+
+import metrics
+
+FLAG = 'MEMOIZE'  # APP_REQUIREMENT attribute declaring its functions deterministic
+FLAG_VALUES = ('YES', 'TRUE', '1')
+
+
+class ResultCache:
+    """Results of deterministic functions by function code and parameters, so repeated executions
+    are answered without reaching an SR. Entries expire after a time to live and the least recently
+    used are evicted once their encoded size exceeds the memory bound. Only successful results are kept.
+    """
+
+    def __init__(self, ttl: float, size: int):
+        """
+        Args:
+            ttl (float): Seconds a result is reused
+            size (int): Bytes of encoded results kept
+        """
+        self.ttl = ttl
+        self.size = size
+
+        self.entries: OrderedDict[tuple[str, str], tuple[float, int, dict]] = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str]) -> dict | None:
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[0] < time.monotonic():
+                self._evict(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[2]
+
+    def set(self, key: tuple[str, str], result: dict):
+        if result["code"] != 200:
+            return
+
+        size = len(json.dumps(result))
+
+        if size > self.size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._evict(key)
+
+            self.entries[key] = (time.monotonic() + self.ttl, size, result)
+            self.bytes += size
+
+            while self.bytes > self.size:
+                self._evict(next(iter(self.entries)))
+
+    def render(self) -> str:
+        """Hits, misses and size of the cache in Prometheus text exposition format"""
+        lines = (metrics.sample('cognit_result_cache_hits_total',
+                                'Executions answered from the result cache', 'counter', self.hits)
+                 + metrics.sample('cognit_result_cache_misses_total',
+                                  'Memoized executions not found in the result cache', 'counter', self.misses)
+                 + metrics.sample('cognit_result_cache_bytes',
+                                  'Encoded size of the results in the result cache', 'gauge', self.bytes))
+
+        return '\n'.join(lines) + '\n'
+
+    def _evict(self, key: tuple[str, str]):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+
+def result_key(fc: str, parameters: list[str]) -> tuple[str, str]:
+    """Cache key of an execution, the SHA-256 of its function code and of its parameters"""
+    params_hash = hashlib.sha256()
+
+    for parameter in parameters:
+        # NUL is not part of the base64 alphabet, parameters cannot run into each other
+        params_hash.update(parameter.encode())
+        params_hash.update(b'\0')
+
+    return code_hash(fc), params_hash.hexdigest()
+
+
+@functools.lru_cache(maxsize=256)
+def code_hash(fc: str) -> str:
+    # hot functions are hashed once
+    return hashlib.sha256(fc.encode()).hexdigest()
+
+
+def memoized(requirement: dict) -> bool:
+    """Whether an APP_REQUIREMENT opts its executions into the result cache"""
+    return str(requirement.get(FLAG, '')).upper() in FLAG_VALUES
@@ -1,9 +1,14 @@
 from fastapi import HTTPException, status
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from typing import Iterator
+import threading
 import requests
-import json
 import logging
 
 from cognit_models import ExecutionMode
+from cognit_broker import prepare_execution_request
+from load_balancer import LOAD_BALANCERS, LoadBalancer, CPULoadBalancer, Runtime
 import opennebula
 
 ERROR_OFFLOAD = "Failed to offload function"
@@ -11,9 +16,126 @@ ERROR_OFFLOAD = "Failed to offload function"
 SR_PORT = 8000
 CLUSTER_ID = None
 LB_MODE = "cpu"
+INDEX_INTERVAL = 10  # seconds between refreshes of the Serverless Runtime index
+CONNECT_TIMEOUT = 5  # seconds to establish a connection to a Serverless Runtime
+READ_TIMEOUT = 60  # seconds to wait for the Serverless Runtime response
+MAX_CONNECTIONS = 10  # connections kept open to each Serverless Runtime
+POOL_TIMEOUT = 5  # seconds to wait for a free connection to a Serverless Runtime
+MAX_ENDPOINTS = 64  # Serverless Runtimes with pooled connections
 
 logger: logging.Logger = None
 one: opennebula.OpenNebulaClient = None
+load_balancer: LoadBalancer = CPULoadBalancer()
+
+
+def set_load_balancer(mode: str):
+    """Select the Serverless Runtime load balancing strategy, one of LOAD_BALANCERS"""
+    global LB_MODE, load_balancer
+
+    if mode not in LOAD_BALANCERS:
+        logger.warning(
+            f"Unknown load balance mode '{mode}'. Using CPU Load Balance mode.")
+        mode = "cpu"
+
+    LB_MODE = mode
+    load_balancer = LOAD_BALANCERS[mode]()
+
+
+class RuntimeIndex:
+    """In-memory map of each flavour to its running Serverless Runtime VMs, their endpoint and last CPU load.
+    It is rebuilt in the background every INDEX_INTERVAL seconds, so oned and oneflow see a constant load
+    regardless of the request rate and requests only perform a lookup.
+    """
+
+    def __init__(self, interval: float = INDEX_INTERVAL):
+        self.interval = interval
+        self.runtimes: dict[str, list[Runtime]] = {}
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._refresh_periodically,
+                         name="runtime-index", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def get(self, flavour: str) -> list[Runtime]:
+        """Running Serverless Runtimes of a flavour"""
+        return self.runtimes.get(flavour, [])
+
+    def refresh(self):
+        flavour_vm_ids: dict[str, set[int]] = {}
+
+        # Get every FAAS VM. FAAS is role 0 on flavour service templates
+        for service in one.get_services():
+            role = service["TEMPLATE"]["BODY"]["roles"][0]
+
+            if role["name"] != "FAAS" or role["cardinality"] == 0:
+                continue
+
+            vm_ids = flavour_vm_ids.setdefault(service["NAME"], set())
+            vm_ids.update(vm["deploy_id"] for vm in role["nodes"])
+
+        # Read the last CPU load of every VM once for every flavour
+        cpu_load = {}
+
+        for vm_monitoring in one.vmpool_monitoring():
+            if vm_monitoring.CPU is not None:
+                cpu_load[vm_monitoring.ID] = vm_monitoring.CPU
+
+        # Every RUNNING SR VM on the cluster, the extended pool info already carries the NICs
+        sr_vm_ids = set().union(*flavour_vm_ids.values())
+        endpoints = {}
+
+        for vm in one.cluster_vms(CLUSTER_ID):
+            if vm.ID not in sr_vm_ids:
+                continue
+
+            endpoint = runtime_endpoint(vm.ID, dict(vm.TEMPLATE))
+
+            if endpoint is not None:
+                endpoints[vm.ID] = endpoint
+
+        runtimes = {}
+
+        for flavour, vm_ids in flavour_vm_ids.items():
+            runtimes[flavour] = [Runtime(vm_id, endpoints[vm_id], cpu_load[vm_id])
+                                 for vm_id in vm_ids if vm_id in endpoints and vm_id in cpu_load]
+
+        # replace the whole index at once, readers never see a partial refresh
+        self.runtimes = runtimes
+        self.ready.set()
+
+        logger.debug(f"Serverless Runtime index refreshed {runtimes}")
+
+    def _refresh_periodically(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Could not refresh Serverless Runtime index: {e}")
+
+            self.stopped.wait(self.interval)
+
+
+# Maintained in the background when started, otherwise runtimes are looked up on every request
+RUNTIME_INDEX: RuntimeIndex = None
+
+
+def start_runtime_index(interval: float = INDEX_INTERVAL):
+    global RUNTIME_INDEX
+
+    RUNTIME_INDEX = RuntimeIndex(interval)
+    RUNTIME_INDEX.start()
+
+
+def stop_runtime_index():
+    global RUNTIME_INDEX
+
+    if RUNTIME_INDEX is not None:
+        RUNTIME_INDEX.stop()
+        RUNTIME_INDEX = None
 
 
 def execute_function(function_id: int, app_req_id: int, parameters: list[str], mode: ExecutionMode):
@@ -21,13 +143,30 @@ def execute_function(function_id: int, app_req_id: int, parameters: list[str], m
     requirement = one.get_app_requirement(app_req_id)
 
     flavour = requirement["FLAVOUR"]
-    services = get_runtime_services(flavour)
 
-    # Get ideal VM based on LB logic
-    vm_ids = get_sr_vm_ids(services)
-    endpoint = get_runtime_endpoint(vm_ids)
+    if RUNTIME_INDEX is not None:
+        runtime = get_indexed_runtime(flavour)
+    else:
+        services = get_runtime_services(flavour)
+
+        # Get ideal VM based on LB logic
+        vm_ids = get_sr_vm_ids(services)
+        runtime = get_runtime(vm_ids)
+
+    offload_request = prepare_execution_request(function, parameters, app_req_id)
+
+    with load_balancer.track(runtime):
+        return offload_function(endpoint=runtime.endpoint, offload_request=offload_request, mode=mode)
+
+
+def get_indexed_runtime(flavour: str) -> Runtime:
+    runtimes = RUNTIME_INDEX.get(flavour)
+
+    if len(runtimes) == 0:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Could not find Serverless Runtime instances for flavour {flavour}")
 
-    return offload_function(function=function, mode=mode, app_req_id=app_req_id, endpoint=endpoint, params=parameters)
+    return load_balancer.select(runtimes)
 
 
 def get_runtime_services(flavour: str) -> list[dict]:
@@ -81,7 +220,7 @@ def get_sr_vm_ids(services: list[dict]) -> list[int]:
     return vm_ids
 
 
-def get_sr_vms_by_cpu(sr_vm_ids: list[int]) -> list:
+def get_sr_vms_by_cpu(sr_vm_ids: list[int]) -> list[Runtime]:
     # can be optimized by getting VMs only for the cognit/serverless group
     # this group would only own SR VMs
     # currently it reads every VM in the pool
@@ -105,45 +244,49 @@ def get_sr_vms_by_cpu(sr_vm_ids: list[int]) -> list:
     cpu_load_sorted = sorted(cpu_load.keys(), key=cpu_load.get)
 
     logger.debug(cpu_load_sorted)
-    return cpu_load_sorted
-
+    return [Runtime(vm_id, None, cpu_load[vm_id]) for vm_id in cpu_load_sorted]
 
-def get_runtime_endpoint(vm_ids: list[int]):
 
-    # TODO: define LB logic when module is loaded. Generate the function.
-    if LB_MODE == "cpu":
-        vm_ids = get_sr_vms_by_cpu(vm_ids)
-    else:
-        logger.warning(
-            f"Unknown load balance mode '{LB_MODE}'. Using CPU Load Balance mode.")
+def get_runtime(vm_ids: list[int]) -> Runtime:
+    candidates = get_sr_vms_by_cpu(vm_ids)
 
-    for vm_id in vm_ids:
-        template = one.vm_info(vm_id)
+    # only the NIC of the selected VM is read, VMs that cannot be reached are discarded
+    while len(candidates) > 0:
+        runtime = load_balancer.select(candidates)
+        template = one.vm_info(runtime.vm_id)
 
         logger.debug(template)
 
-        if 'NIC' not in template:
-            logger.error(f"Serverless Runtime VM {vm_id} does not have NIC")
-            continue
+        endpoint = runtime_endpoint(runtime.vm_id, template)
 
-        # ip = template['NIC'][0]['IP'] Multiple NIC turns NIC into an array
-        # VMs with 1 NIC assumed
-        if 'IP' in template["NIC"]:
-            ip = template["NIC"]["IP"]
-            runtime_endpoint = f"http://{ip}:{SR_PORT}"
-        elif 'IP6' in template["NIC"]:
-            ip = template["NIC"]["IP6"]
-            runtime_endpoint = f"http://[{ip}]:{SR_PORT}"
-        else:
-            logger.error(f"Serverless Runtime VM '{vm_id}' does not have IP")
-            continue
+        if endpoint is not None:
+            return runtime._replace(endpoint=endpoint)
 
-        return runtime_endpoint
+        candidates.remove(runtime)
 
     raise HTTPException(
         status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_OFFLOAD)
 
 
+def runtime_endpoint(vm_id: int, template: dict) -> str | None:
+    """SR API endpoint of a VM, None if the VM cannot be reached"""
+    if 'NIC' not in template:
+        logger.error(f"Serverless Runtime VM {vm_id} does not have NIC")
+        return None
+
+    # ip = template['NIC'][0]['IP'] Multiple NIC turns NIC into an array
+    # VMs with 1 NIC assumed
+    if 'IP' in template["NIC"]:
+        ip = template["NIC"]["IP"]
+        return f"http://{ip}:{SR_PORT}"
+    elif 'IP6' in template["NIC"]:
+        ip = template["NIC"]["IP6"]
+        return f"http://[{ip}]:{SR_PORT}"
+
+    logger.error(f"Serverless Runtime VM '{vm_id}' does not have IP")
+    return None
+
+
 # EXAMPLE_FUNCTION = {
 #     "fc": "gAWVHAIAAAAAAACMF2Nsb3VkcGlja2xlLmNsb3VkcGlja2xllIwOX21ha2VfZnVuY3Rpb26Uk5QoaACMDV9idWlsdGluX3R5cGWUk5SMCENvZGVUeXBllIWUUpQoSwNLAEsASwNLAktDQwx8AHwBFAB8AhQAUwCUToWUKYwBYZSMAWKUjAFjlIeUjGIvaG9tZS9hYnJvc2EvcmVwb3MvZ2l0aHViLWRldmljZS1ydW50aW1lLXB5L2NvZ25pdC90ZXN0L2ludGVncmF0aW9uL3Rlc3RfaW50ZWdyYXRpb25fU1JfY29udGV4dC5weZSMCmR1bW15X2Z1bmOUS5pDAgwBlCkpdJRSlH2UTk5OdJRSlIwcY2xvdWRwaWNrbGUuY2xvdWRwaWNrbGVfZmFzdJSMEl9mdW5jdGlvbl9zZXRzdGF0ZZSTlGgVfZR9lCiMCF9fbmFtZV9flGgPjAxfX3F1YWxuYW1lX1+UaA+MD19fYW5ub3RhdGlvbnNfX5R9lIwOX19rd2RlZmF1bHRzX1+UTowMX19kZWZhdWx0c19flE6MCl9fbW9kdWxlX1+UjCdpbnRlZ3JhdGlvbi50ZXN0X2ludGVncmF0aW9uX1NSX2NvbnRleHSUjAdfX2RvY19flE6MC19fY2xvc3VyZV9flE6MF19jbG91ZHBpY2tsZV9zdWJtb2R1bGVzlF2UjAtfX2dsb2JhbHNfX5R9lHWGlIZSMC4=",
 #     "fc_hash": "83f8679345fd4b5d215f2b8fcd7c7d51b154084494e92b7ca0a8a5ccf64aafe8",
@@ -164,6 +307,74 @@ def get_runtime_endpoint(vm_ids: list[int]):
 #         "faas_task_uuid": "ac249cb6-8425-11ef-b968-c297e15a9b8f"
 #     }
 # }
+# Keep-alive connections to the Serverless Runtimes, created on first use
+http_session: requests.Session = None
+# offloads in flight per endpoint, [slots, users]. Dropped once unused, so runtimes that are gone are forgotten
+endpoint_slots: dict[str, list] = {}
+endpoint_slots_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    global http_session
+
+    if http_session is None:
+        # concurrent offloads per endpoint are bounded by endpoint_slot(), the pool never has to block
+        adapter = HTTPAdapter(pool_connections=MAX_ENDPOINTS, pool_maxsize=MAX_CONNECTIONS)
+
+        http_session = requests.Session()
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+
+    return http_session
+
+
+def close_http_session():
+    global http_session
+
+    if http_session is not None:
+        http_session.close()
+        http_session = None
+
+
+@contextmanager
+def endpoint_slot(endpoint: str) -> Iterator[None]:
+    """Hold one of the MAX_CONNECTIONS offloads allowed in flight to an endpoint
+
+    Raises:
+        HTTPException: 503 if no offload to the endpoint finishes within POOL_TIMEOUT
+    """
+    with endpoint_slots_lock:
+        slot = endpoint_slots.setdefault(endpoint, [threading.BoundedSemaphore(MAX_CONNECTIONS), 0])
+        slot[1] += 1
+
+    try:
+        if not slot[0].acquire(timeout=POOL_TIMEOUT):
+            logger.error(f"Too many offloads in flight to {endpoint}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=ERROR_OFFLOAD)
+
+        try:
+            yield
+        finally:
+            slot[0].release()
+    finally:
+        with endpoint_slots_lock:
+            slot[1] -= 1
+
+            if slot[1] == 0:
+                del endpoint_slots[endpoint]
+
+
+def offload_url(endpoint: str, mode: ExecutionMode) -> str:
+    # Ideally SR API should handle execution mode as query parameter as well instead of two separate URI
+    if mode == "sync":
+        url = f"{endpoint}/v1/faas/execute-sync"
+    elif mode == "async":
+        url = f"{endpoint}/v1/faas/execute-async"
+
+    return url
+
+
 # Direct SR function execution offloading is deprecated. Queue the execution request instead
 def offload_function(endpoint: str, offload_request: dict, mode: ExecutionMode):
     """Offload the function execution to the Serverless Runtime instance
@@ -176,18 +387,21 @@ def offload_function(endpoint: str, offload_request: dict, mode: ExecutionMode):
     Returns:
         _type_: Response from the SR App
     """
-
-    # Ideally SR API should handle execution mode as query parameter as well instead of two separate URI
-    if mode == "sync":
-        url = f"{endpoint}/v1/faas/execute-sync"
-    elif mode == "async":
-        url = f"{endpoint}/v1/faas/execute-async"
+    url = offload_url(endpoint, mode)
 
     logger.info(f"Sending function offload to {url}")
     logger.debug(offload_request)
 
     try:
-        response = requests.post(url=url, data=json.dumps(offload_request))
+        with endpoint_slot(endpoint):
+            response = get_http_session().post(
+                url=url, json=offload_request, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except HTTPException:
+        raise
+    except requests.Timeout as e:
+        logger.error(e)
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=ERROR_OFFLOAD)
     except Exception as e:
         logger.error(e)
         raise HTTPException(
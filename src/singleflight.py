@@ -0,0 +1,67 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+import threading
+
+
+class SingleFlight:
+    """Operations in flight by key. Concurrent identical operations join the one already in flight
+    and receive its result, or its exception, instead of running again.
+    """
+
+    def __init__(self):
+        self.flights: dict[Hashable, Future] = {}
+        self.lock = threading.Lock()
+
+        self.shared = 0  # operations answered by an identical one in flight
+
+    def join(self, key: Hashable) -> tuple[Future, bool]:
+        """Join the operation in flight for a key, or start it
+
+        Returns:
+            tuple[Future, bool]: Future of the operation result, and whether the caller started the
+                operation and has to land() it
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+
+            if flight is not None:
+                self.shared += 1
+                return flight, False
+
+            flight = self.flights[key] = Future()
+
+            return flight, True
+
+    def land(self, key: Hashable, result: Any = None, error: BaseException = None):
+        """Finish the operation of a key, handing its result or exception to the operations that joined it"""
+        with self.lock:
+            flight = self.flights.pop(key, None)
+
+        if flight is None:
+            return
+
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> tuple[Any, bool]:
+        """Run a function, unless an identical call is in flight
+
+        Returns:
+            tuple[Any, bool]: Result of the function, and whether it was shared by an identical call
+        """
+        flight, leader = self.join(key)
+
+        if not leader:
+            return flight.result(), True
+
+        try:
+            result = function()
+        except BaseException as e:
+            self.land(key, error=e)
+            raise
+
+        self.land(key, result)
+
+        return result, False
@@ -0,0 +1,77 @@
+import base64
+import binascii
+import functools
+import json
+import msgpack
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CONTENT_TYPES = {  # wire_formats setting -> AMQP content_type
+    'json': JSON,
+    'msgpack': MSGPACK
+}
+
+
+def encode(message: dict | list, content_type: str = None) -> bytes | str:
+    """Serialize a broker message. Messages without content type are JSON, which every SR understands.
+
+    In msgpack, the base64 function code and parameters of execution requests travel as raw bytes.
+    """
+    if content_type == MSGPACK:
+        return msgpack.packb(_binary_request(message))
+
+    return json.dumps(message)
+
+
+def decode(body: bytes, content_type: str = None) -> dict | list:
+    """Deserialize a broker message according to its content type. Raw bytes are returned base64
+    encoded, as devices expect them.
+    """
+    if content_type == MSGPACK:
+        return _text(msgpack.unpackb(body))
+
+    return json.loads(body)
+
+
+def _binary_request(message):
+    payload = message.get("payload") if isinstance(message, dict) else None
+
+    if not isinstance(payload, dict):
+        return message
+
+    payload = dict(payload)
+
+    if isinstance(payload.get("fc"), str):
+        payload["fc"] = _function_code(payload["fc"])
+
+    if isinstance(payload.get("params"), list):
+        payload["params"] = [_bytes(param) if isinstance(param, str) else param for param in payload["params"]]
+
+    return {**message, "payload": payload}
+
+
+@functools.lru_cache(maxsize=256)
+def _function_code(fc: str) -> bytes | str:
+    # the same function is usually executed many times in a row
+    return _bytes(fc)
+
+
+def _bytes(value: str) -> bytes | str:
+    """Raw bytes of a base64 string, the string itself if it is not valid base64"""
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        return value
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+
+    if isinstance(value, dict):
+        return {key: _text(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [_text(item) for item in value]
+
+    return value
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""Load generator measuring the latency and throughput of the execute path.
+
+The edge cluster frontend runs in this process against stand-ins for oned, oneflow and the Cognit
+Frontend, and against Serverless Runtime consumers answering every execution request after a fixed
+delay. The broker is either an in-process stand-in or a real RabbitMQ given by its endpoint.
+
+    ./benchmark.py --requests 2000 --concurrency 64
+    ./benchmark.py --mode async --broker http://localhost:5672 --set reply_queue=shared
+
+Everything shares the GIL of this process, results are meant to be compared between runs on the
+same host rather than with a deployed frontend.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+import httpx
+import pika
+import uvicorn
+import yaml
+
+import fake_services
+import memory_broker
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+import wire  # noqa: E402
+
+FUNCTION_ID = 1
+APP_REQ_ID = fake_services.APP_REQUIREMENT_ID
+FLAVOUR = 'Benchmark'
+USER = 'benchmark'
+PASSWORD = 'benchmark'
+PARAMETERS = ['gAVLAi4=', 'gAVLAy4=']
+FC = 'gAWVHAIAAAAAAACMF2Nsb3VkcGlja2xlLmNsb3VkcGlja2xllIwOX21ha2VfZnVuY3Rpb26Uk5Q='
+FC_HASH = '83f8679345fd4b5d215f2b8fcd7c7d51b154084494e92b7ca0a8a5ccf64aafe8'
+RESULT = {"ret_code": 0, "res": "gAVLBS4=", "err": None}
+POLL_WAIT = 10  # seconds each poll of an asynchronous execution waits for its result
+PERCENTILES = (50, 95, 99)
+
+
+class ServerlessRuntime(threading.Thread):
+    """Consumer of the flavour queue answering every execution request after a delay, like
+    serverless_runtime_broker_client.py does with the results of its Serverless Runtime
+    """
+
+    def __init__(self, parameters: pika.ConnectionParameters, delay: float):
+        super().__init__(daemon=True)
+        self.delay = delay
+        self.codes: dict[str, str] = {}
+        self.executions = 0
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=FLAVOUR)
+        self.channel.basic_qos(prefetch_count=1)
+        self.channel.basic_consume(queue=FLAVOUR, on_message_callback=self.subscriber_function)
+
+    def run(self):
+        self.channel.start_consuming()
+
+    def stop(self):
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+        self.join()
+        self.connection.close()
+
+    def subscriber_function(self, channel, method, properties, body):
+        execution_request = wire.decode(body, properties.content_type)
+        payload = execution_request["payload"]
+
+        if "fc" in payload or self.function_code(payload["fc_hash"], payload["fc_url"]):
+            if self.delay > 0:
+                time.sleep(self.delay)
+
+            result = {"code": 200, "message": RESULT}
+            self.executions += 1
+        else:
+            result = {"code": 412, "message": "Function code not available"}
+
+        result = wire.encode(result, properties.content_type)
+
+        channel.basic_publish(exchange='results', routing_key=execution_request["request_id"], body=result,
+                              properties=pika.BasicProperties(content_type=properties.content_type))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def function_code(self, fc_hash: str, fc_url: str) -> bool:
+        if fc_hash not in self.codes:
+            response = httpx.get(fc_url)
+
+            if response.status_code != 200:
+                return False
+
+            self.codes[fc_hash] = response.text
+
+        return True
+
+
+async def execute(client: httpx.AsyncClient, mode: str, token: str, memoize: bool) -> tuple[float, int]:
+    """Run one execution
+
+    Returns:
+        tuple[float, int]: Seconds until its result was received and the final status code
+    """
+    start = time.perf_counter()
+    headers = {'token': token}
+
+    if memoize:
+        headers['memoize'] = 'true'
+
+    response = await client.post(f'/v1/functions/{FUNCTION_ID}/execute', headers=headers, json=PARAMETERS,
+                                 params={'app_req_id': APP_REQ_ID, 'mode': mode})
+
+    if mode == 'async' and response.status_code == 202:
+        request_id = response.json()['request_id']
+
+        while response.status_code == 202:
+            response = await client.get(f'/v1/executions/{request_id}', headers=headers,
+                                        params={'wait': POLL_WAIT})
+
+    return time.perf_counter() - start, response.status_code
+
+
+async def generate_load(endpoint: str, requests: int, concurrency: int, mode: str, token: str,
+                        memoize: bool) -> tuple[float, list[tuple[float, int]]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=endpoint, limits=limits, timeout=None) as client:
+        async def limited():
+            async with semaphore:
+                return await execute(client, mode, token, memoize)
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(limited() for _ in range(requests)))
+
+        return time.perf_counter() - start, samples
+
+
+def percentile(values: list[float], percentile: int) -> float:
+    return values[max(0, -(-percentile * len(values) // 100) - 1)]
+
+
+def report(elapsed: float, samples: list[tuple[float, int]]):
+    latencies = sorted(latency for latency, code in samples if code == 200)
+    codes = Counter(code for _, code in samples)
+
+    print(f"requests: {len(samples)}  elapsed: {elapsed:.2f}s  throughput: {len(samples) / elapsed:.1f} req/s")
+
+    if latencies:
+        summary = '  '.join(f"p{p}: {percentile(latencies, p) * 1000:.1f}ms" for p in PERCENTILES)
+        print(f"latency {summary}  max: {latencies[-1] * 1000:.1f}ms")
+
+    print("status codes: " + '  '.join(f"{code}: {count}" for code, count in sorted(codes.items())))
+
+
+def setting(value: str) -> tuple[str, object]:
+    key, _, raw = value.partition('=')
+
+    return key, yaml.safe_load(raw)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help="executions to run")
+    parser.add_argument('--concurrency', type=int, default=32, help="executions running at the same time")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='sync',
+                        help="execution mode, async executions are polled until they finish")
+    parser.add_argument('--warmup', type=int, default=50, help="executions run before measuring")
+    parser.add_argument('--sr-workers', type=int, default=8, help="Serverless Runtime consumers")
+    parser.add_argument('--sr-delay', type=float, default=0, help="seconds each execution takes")
+    parser.add_argument('--oned-latency', type=float, default=0, help="seconds each oned call takes")
+    parser.add_argument('--memoize', action='store_true',
+                        help="opt executions into the result cache, every one has the same parameters")
+    parser.add_argument('--broker', default='memory',
+                        help="'memory' for the in-process broker or the endpoint of a RabbitMQ broker")
+    parser.add_argument('--set', type=setting, action='append', default=[], metavar='KEY=VALUE',
+                        help="edge cluster frontend configuration, e.g. reply_queue=shared")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    cognit_frontend = fake_services.CognitFrontend()
+    oneflow = fake_services.OneFlow()
+    oned = fake_services.OneD(flavour=FLAVOUR, fc=FC, fc_hash=FC_HASH, latency=args.oned_latency)
+
+    if args.broker == 'memory':
+        memory_broker.install()
+        broker = 'http://localhost:5672'
+    else:
+        broker = args.broker
+
+    config = {
+        'one_xmlrpc': oned.endpoint,
+        'oneflow': oneflow.endpoint,
+        'cognit_frontend': cognit_frontend.endpoint,
+        'broker': broker,
+        'log_level': 'warning'
+    }
+    config.update(args.set)
+
+    if args.broker == 'memory' and config.get('execution_backend') == 'asyncio':
+        sys.exit("The asyncio execution backend needs a RabbitMQ broker")
+
+    with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as file:
+        yaml.safe_dump(config, file)
+
+    os.environ['COGNIT_EDGE_CLUSTER_FRONTEND_CONF'] = file.name
+
+    try:
+        import main as frontend
+        import cognit_broker
+    finally:
+        os.unlink(file.name)
+
+    parameters = cognit_broker.connection_parameters(broker)
+    runtimes = [ServerlessRuntime(parameters, args.sr_delay) for _ in range(args.sr_workers)]
+
+    for runtime in runtimes:
+        runtime.start()
+
+    server = uvicorn.Server(uvicorn.Config(frontend.app, host='127.0.0.1', port=0, log_level='warning'))
+    # the frontend logs every execution on the uvicorn logger
+    logging.getLogger('uvicorn').setLevel(logging.WARNING)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+    port = server.servers[0].sockets[0].getsockname()[1]
+    endpoint = f'http://127.0.0.1:{port}'
+
+    while httpx.get(f'{endpoint}/readyz').status_code != 200:
+        time.sleep(0.1)
+
+    token = cognit_frontend.token(USER, PASSWORD)
+
+    try:
+        if args.warmup > 0:
+            asyncio.run(generate_load(endpoint, args.warmup, args.concurrency, args.mode, token, args.memoize))
+
+        elapsed, samples = asyncio.run(
+            generate_load(endpoint, args.requests, args.concurrency, args.mode, token, args.memoize))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+        for runtime in runtimes:
+            runtime.stop()
+
+    report(elapsed, samples)
+    print(f"oned calls: {oned.calls}  SR executions: {sum(runtime.executions for runtime in runtimes)}")
+
+
+if __name__ == '__main__':
+    main()
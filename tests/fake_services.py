@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""Stand-ins for the services the edge cluster frontend depends on, for benchmarks on hosts without them.
+
+Every server listens on localhost on a free port and runs in a daemon thread.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer
+import json
+import threading
+import time
+from biscuit_auth import BiscuitBuilder, KeyPair
+
+APP_REQUIREMENT_ID = 100  # document IDs from this one on are App Requirements, Functions below it
+
+DOCUMENT = """<DOCUMENT><ID>{id}</ID><UID>0</UID><GID>0</GID><UNAME>{user}</UNAME><GNAME>users</GNAME>
+<NAME>benchmark</NAME><TYPE>{type}</TYPE><PERMISSIONS><OWNER_U>1</OWNER_U><OWNER_M>1</OWNER_M>
+<OWNER_A>0</OWNER_A><GROUP_U>0</GROUP_U><GROUP_M>0</GROUP_M><GROUP_A>0</GROUP_A><OTHER_U>0</OTHER_U>
+<OTHER_M>0</OTHER_M><OTHER_A>0</OTHER_A></PERMISSIONS><TEMPLATE>{template}</TEMPLATE></DOCUMENT>"""
+
+APP_REQUIREMENT = "<FLAVOUR><![CDATA[{flavour}]]></FLAVOUR>"
+FUNCTION = "<FC><![CDATA[{fc}]]></FC><FC_HASH><![CDATA[{fc_hash}]]></FC_HASH><LANG><![CDATA[PY]]></LANG>"
+
+
+class CognitFrontend:
+    """Serves the public key biscuit tokens are verified with, and issues tokens signed by it"""
+
+    def __init__(self):
+        self.key_pair = KeyPair()
+        public_key = json.dumps(self.key_pair.public_key.to_hex()).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/v1/public_key':
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(public_key)))
+                self.end_headers()
+                self.wfile.write(public_key)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = serve(ThreadingHTTPServer(('127.0.0.1', 0), Handler))
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}"
+
+    def token(self, user: str, password: str) -> str:
+        builder = BiscuitBuilder(f'user("{user}"); password("{password}");')
+
+        return builder.build(self.key_pair.private_key).to_base64()
+
+
+class OneFlow:
+    """Accepts connections to the oneflow endpoint, every service list is empty"""
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({'DOCUMENT_POOL': {'DOCUMENT': []}}).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = serve(ThreadingHTTPServer(('127.0.0.1', 0), Handler))
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}"
+
+
+class OneD:
+    """Answers one.document.info for any document ID, taking latency seconds per call"""
+
+    def __init__(self, flavour: str, fc: str, fc_hash: str, latency: float = 0):
+        self.flavour = flavour
+        self.fc = fc
+        self.fc_hash = fc_hash
+        self.latency = latency
+        self.calls = 0
+
+        class Server(ThreadingMixIn, SimpleXMLRPCServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        server = Server(('127.0.0.1', 0), logRequests=False, allow_none=True)
+        server.register_function(self.document_info, 'one.document.info')
+
+        self.server = serve(server)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/RPC2"
+
+    def document_info(self, session: str, document_id: int, *args) -> list:
+        self.calls += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if document_id >= APP_REQUIREMENT_ID:
+            document_type = 1338
+            template = APP_REQUIREMENT.format(flavour=self.flavour)
+        else:
+            document_type = 1339
+            template = FUNCTION.format(fc=self.fc, fc_hash=self.fc_hash)
+
+        user = session.split(':')[0]
+
+        return [True, DOCUMENT.format(id=document_id, user=user, type=document_type, template=template), 0]
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import collections
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(project_root, "src"))
+
+from load_balancer import LOAD_BALANCERS, Runtime  # noqa: E402
+
+SELECTIONS = 300
+
+flavours = {
+    'Energy': [Runtime(1, 'http://10.0.0.1:8000', 10), Runtime(2, 'http://10.0.0.2:8000', 50),
+               Runtime(3, 'http://10.0.0.3:8000', 80)],
+    'Vision': [Runtime(11, 'http://10.0.1.1:8000', 10), Runtime(12, 'http://10.0.1.2:8000', 50),
+               Runtime(13, 'http://10.0.1.3:8000', 80)]
+}
+
+for name, load_balancer_class in LOAD_BALANCERS.items():
+    load_balancer = load_balancer_class()
+    selected = {flavour: collections.Counter() for flavour in flavours}
+
+    # requests of every flavour arrive interleaved, as they do on a worker
+    for _ in range(SELECTIONS):
+        for flavour, runtimes in flavours.items():
+            runtime = load_balancer.select(runtimes)
+
+            assert runtime in runtimes
+            selected[flavour][runtime.vm_id] += 1
+
+    print(f"{name}: {dict(selected)}")
+
+    if name == 'weighted_round_robin':
+        # every runtime takes turns in proportion to its idle CPU, regardless of the other flavours
+        for flavour, runtimes in flavours.items():
+            total = sum(100 - runtime.cpu for runtime in runtimes)
+
+            for runtime in runtimes:
+                expected = SELECTIONS * (100 - runtime.cpu) / total
+                assert abs(selected[flavour][runtime.vm_id] - expected) <= 1, selected[flavour]
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+"""In-process stand-in for a RabbitMQ broker, for benchmarks on hosts without one.
+
+install() replaces pika.BlockingConnection with MemoryConnection. It implements the parts of the
+BlockingConnection and BlockingChannel API used by the edge cluster frontend and the Serverless
+Runtime broker client, with RabbitMQ semantics for routing, exclusive and auto delete queues,
+unacknowledged messages, per message expiration and publisher confirms. Queue expiration
+(x-expires) and persistence are not implemented.
+"""
+
+from collections import defaultdict, deque
+import itertools
+import threading
+import time
+import pika
+import pika.frame
+import pika.spec
+from pika.exceptions import ChannelClosedByBroker, ChannelWrongStateError, ConnectionWrongStateError, \
+    UnroutableError
+
+
+class Message:
+    __slots__ = ('exchange', 'routing_key', 'properties', 'body', 'expires')
+
+    def __init__(self, exchange: str, routing_key: str, properties: pika.BasicProperties, body: bytes,
+                 ttl: float | None):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = properties or pika.BasicProperties()
+        self.body = body
+        self.expires = None if ttl is None else time.monotonic() + ttl
+
+
+class Queue:
+
+    def __init__(self, name: str, owner: 'MemoryConnection', auto_delete: bool, arguments: dict):
+        self.name = name
+        self.owner = owner  # connection of exclusive queues
+        self.auto_delete = auto_delete
+        self.message_ttl = (arguments or {}).get('x-message-ttl')
+        self.messages: deque[Message] = deque()
+        self.consumers = 0
+        self.consumed = False
+
+    def pop(self) -> Message | None:
+        now = time.monotonic()
+
+        while self.messages:
+            message = self.messages.popleft()
+
+            if message.expires is None or message.expires > now:
+                return message
+
+        return None
+
+
+class Broker:
+    """State shared by every connection. The condition guards it and is notified of every change."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.exchanges: dict[str, str] = {'': 'direct'}
+        self.queues: dict[str, Queue] = {}
+        self.bindings: dict[str, dict[str, set[str]]] = defaultdict(lambda: defaultdict(set))
+        self.names = itertools.count(1)
+
+    def route(self, exchange: str, routing_key: str) -> list[Queue]:
+        if exchange == '':
+            names = [routing_key]
+        elif self.exchanges.get(exchange) == 'fanout':
+            names = set().union(*self.bindings[exchange].values())
+        else:
+            names = self.bindings[exchange].get(routing_key, ())
+
+        return [self.queues[name] for name in names if name in self.queues]
+
+    def delete_queue(self, name: str):
+        self.queues.pop(name, None)
+
+        for routes in self.bindings.values():
+            for queues in routes.values():
+                queues.discard(name)
+
+
+BROKER = Broker()
+
+
+class MemoryChannel:
+
+    def __init__(self, connection: 'MemoryConnection', number: int):
+        self.connection = connection
+        self.channel_number = number
+        self.is_open = True
+        self.confirming = False
+        self.prefetch = 0
+        self.consuming = False
+
+        self.consumers: dict[str, tuple[str, callable, bool]] = {}  # tag -> queue, callback, auto ack
+        self.unacked: dict[int, tuple[Queue, Message]] = {}
+        self.delivery_tags = itertools.count(1)
+        self.consumer_tags = itertools.count(1)
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def exchange_declare(self, exchange: str, exchange_type: str = 'direct', **kwargs):
+        with BROKER.condition:
+            BROKER.exchanges.setdefault(exchange, exchange_type)
+
+    def queue_declare(self, queue: str = '', passive: bool = False, durable: bool = False,
+                      exclusive: bool = False, auto_delete: bool = False, arguments: dict = None):
+        self._check_open()
+
+        with BROKER.condition:
+            if queue == '':
+                queue = f"amq.gen-{next(BROKER.names)}"
+
+            declared = BROKER.queues.get(queue)
+
+            if declared is None:
+                if passive:
+                    self._close_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+
+                declared = BROKER.queues[queue] = Queue(
+                    queue, self.connection if exclusive else None, auto_delete, arguments)
+
+                if exclusive:
+                    self.connection.exclusive.add(queue)
+
+            return pika.frame.Method(self.channel_number, pika.spec.Queue.DeclareOk(
+                queue=queue, message_count=len(declared.messages), consumer_count=declared.consumers))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, arguments: dict = None):
+        with BROKER.condition:
+            BROKER.bindings[exchange][routing_key or queue].add(queue)
+
+    def queue_unbind(self, queue: str, exchange: str = None, routing_key: str = None, arguments: dict = None):
+        with BROKER.condition:
+            BROKER.bindings[exchange][routing_key or queue].discard(queue)
+
+    def queue_delete(self, queue: str, if_unused: bool = False, if_empty: bool = False):
+        with BROKER.condition:
+            BROKER.delete_queue(queue)
+
+    def basic_qos(self, prefetch_size: int = 0, prefetch_count: int = 0, global_qos: bool = False):
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties = None,
+                      mandatory: bool = False):
+        self._check_open()
+
+        if isinstance(body, str):
+            body = body.encode()
+
+        with BROKER.condition:
+            queues = BROKER.route(exchange, routing_key)
+
+            if not queues:
+                if mandatory and self.confirming:
+                    raise UnroutableError([])
+                return
+
+            for queue in queues:
+                ttl = None
+
+                if properties is not None and properties.expiration is not None:
+                    ttl = int(properties.expiration) / 1000
+                elif queue.message_ttl is not None:
+                    ttl = queue.message_ttl / 1000
+
+                queue.messages.append(Message(exchange, routing_key, properties, body, ttl))
+
+            BROKER.condition.notify_all()
+
+    def basic_get(self, queue: str, auto_ack: bool = False):
+        self._check_open()
+
+        with BROKER.condition:
+            declared = BROKER.queues.get(queue)
+            message = declared.pop() if declared is not None else None
+
+            if message is None:
+                return None, None, None
+
+            delivery_tag = self._delivered(declared, message, auto_ack)
+
+            method = pika.spec.Basic.GetOk(delivery_tag=delivery_tag, exchange=message.exchange,
+                                           routing_key=message.routing_key,
+                                           message_count=len(declared.messages))
+
+        return method, message.properties, message.body
+
+    def basic_consume(self, queue: str, on_message_callback: callable, auto_ack: bool = False,
+                      exclusive: bool = False, consumer_tag: str = None, arguments: dict = None) -> str:
+        self._check_open()
+
+        with BROKER.condition:
+            declared = BROKER.queues.get(queue)
+
+            if declared is None:
+                self._close_by_broker(404, f"NOT_FOUND - no queue '{queue}'")
+
+            declared.consumers += 1
+            declared.consumed = True
+
+        consumer_tag = consumer_tag or f"ctag{self.channel_number}.{next(self.consumer_tags)}"
+        self.consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag: str):
+        consumer = self.consumers.pop(consumer_tag, None)
+
+        if consumer is None:
+            return
+
+        with BROKER.condition:
+            declared = BROKER.queues.get(consumer[0])
+
+            if declared is not None:
+                declared.consumers -= 1
+
+                if declared.auto_delete and declared.consumers == 0:
+                    BROKER.delete_queue(declared.name)
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        if multiple:
+            for tag in [tag for tag in self.unacked if tag <= delivery_tag]:
+                del self.unacked[tag]
+        else:
+            self.unacked.pop(delivery_tag, None)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True):
+        tags = [tag for tag in self.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        self._requeue([self.unacked.pop(tag) for tag in tags if tag in self.unacked] if requeue else [])
+
+        for tag in tags:
+            self.unacked.pop(tag, None)
+
+    def start_consuming(self):
+        self.consuming = True
+
+        while self.consuming and self.consumers and self.is_open:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag: str = None):
+        self.consuming = False
+
+        for tag in list(self.consumers):
+            self.basic_cancel(tag)
+
+    def consume(self, queue: str, auto_ack: bool = False, exclusive: bool = False, arguments: dict = None,
+                inactivity_timeout: float = None):
+        received = deque()
+        self._generator = self.basic_consume(
+            queue, lambda channel, method, properties, body: received.append((method, properties, body)),
+            auto_ack=auto_ack)
+
+        while self._generator in self.consumers:
+            if not received:
+                self.connection.process_data_events(time_limit=inactivity_timeout)
+
+            if received:
+                yield received.popleft()
+            elif inactivity_timeout is not None:
+                yield None, None, None
+
+    def cancel(self) -> int:
+        tag = getattr(self, '_generator', None)
+
+        if tag is not None:
+            self.basic_cancel(tag)
+
+        return 0
+
+    def close(self, reply_code: int = 0, reply_text: str = 'Normal shutdown'):
+        if not self.is_open:
+            raise ChannelWrongStateError('Channel is closed.')
+
+        for tag in list(self.consumers):
+            self.basic_cancel(tag)
+
+        self._requeue(self.unacked.values())
+        self.unacked.clear()
+        self.is_open = False
+
+    def _delivered(self, queue: Queue, message: Message, auto_ack: bool) -> int:
+        delivery_tag = next(self.delivery_tags)
+
+        if not auto_ack:
+            self.unacked[delivery_tag] = (queue, message)
+
+        return delivery_tag
+
+    def _requeue(self, deliveries):
+        with BROKER.condition:
+            for queue, message in reversed(list(deliveries)):
+                if queue.name in BROKER.queues:
+                    queue.messages.appendleft(message)
+
+            BROKER.condition.notify_all()
+
+    def _next_delivery(self):
+        """Message for the first consumer with a ready message, taken under the broker lock"""
+        if self.prefetch and len(self.unacked) >= self.prefetch:
+            return None
+
+        for tag, (queue, callback, auto_ack) in self.consumers.items():
+            declared = BROKER.queues.get(queue)
+            message = declared.pop() if declared is not None else None
+
+            if message is not None:
+                method = pika.spec.Basic.Deliver(
+                    consumer_tag=tag, delivery_tag=self._delivered(declared, message, auto_ack),
+                    exchange=message.exchange, routing_key=message.routing_key)
+
+                return callback, method, message.properties, message.body
+
+        return None
+
+    def _check_open(self):
+        if not self.is_open:
+            raise ChannelWrongStateError('Channel is closed.')
+
+    def _close_by_broker(self, reply_code: int, reply_text: str):
+        self.is_open = False
+        raise ChannelClosedByBroker(reply_code, reply_text)
+
+
+class MemoryConnection:
+
+    def __init__(self, parameters: pika.ConnectionParameters = None):
+        self.is_open = True
+        self.channels: list[MemoryChannel] = []
+        self.exclusive: set[str] = set()
+        self.callbacks: deque[callable] = deque()
+        self.timers: list[list] = []
+        self.channel_numbers = itertools.count(1)
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def channel(self) -> MemoryChannel:
+        if not self.is_open:
+            raise ConnectionWrongStateError('Connection is closed.')
+
+        self.channels = [channel for channel in self.channels if channel.is_open]
+        channel = MemoryChannel(self, next(self.channel_numbers))
+        self.channels.append(channel)
+
+        return channel
+
+    def add_callback_threadsafe(self, callback: callable):
+        if not self.is_open:
+            raise ConnectionWrongStateError('Connection is closed.')
+
+        with BROKER.condition:
+            self.callbacks.append(callback)
+            BROKER.condition.notify_all()
+
+    def call_later(self, delay: float, callback: callable) -> list:
+        timer = [time.monotonic() + delay, callback]
+        self.timers.append(timer)
+
+        return timer
+
+    def remove_timeout(self, timer: list):
+        if timer in self.timers:
+            self.timers.remove(timer)
+
+    def process_data_events(self, time_limit: float = 0):
+        """Dispatch callbacks, due timers and at most one message per channel, waiting up to time_limit
+        seconds for any of them. None waits until something is dispatched.
+        """
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+
+        with BROKER.condition:
+            while True:
+                callbacks = list(self.callbacks)
+                self.callbacks.clear()
+
+                now = time.monotonic()
+                due = [timer for timer in self.timers if timer[0] <= now]
+
+                for timer in due:
+                    self.timers.remove(timer)
+
+                deliveries = [(channel, delivery) for channel in self.channels if channel.is_open
+                              for delivery in [channel._next_delivery()] if delivery is not None]
+
+                if callbacks or due or deliveries:
+                    break
+
+                timeout = None if deadline is None else deadline - now
+
+                if self.timers:
+                    next_timer = min(timer[0] for timer in self.timers) - now
+                    timeout = next_timer if timeout is None else min(timeout, next_timer)
+
+                if timeout is not None and timeout <= 0:
+                    return
+
+                BROKER.condition.wait(timeout)
+
+        for callback in callbacks:
+            callback()
+
+        for _, callback in due:
+            callback()
+
+        for channel, (callback, method, properties, body) in deliveries:
+            callback(channel, method, properties, body)
+
+    def sleep(self, duration: float):
+        self.process_data_events(time_limit=duration)
+
+    def close(self, reply_code: int = 200, reply_text: str = 'Normal shutdown'):
+        if not self.is_open:
+            raise ConnectionWrongStateError('Connection is closed.')
+
+        for channel in self.channels:
+            if channel.is_open:
+                channel.close()
+
+        with BROKER.condition:
+            for queue in self.exclusive:
+                BROKER.delete_queue(queue)
+
+        self.is_open = False
+
+
+def install():
+    """Make pika.BlockingConnection connect to the in-process broker"""
+    pika.BlockingConnection = MemoryConnection
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import base64
+import hashlib
+import os
+import requests
+import tests_common as tests
+
+from object_store import ObjectStore  # noqa: E402
+from function_code import FunctionCodeStore  # noqa: E402
+
+logger = tests.logger
+conf = tests.CONF["object_store"]
+
+store = ObjectStore(logger=logger, endpoint=conf["endpoint"], access_key=conf["access_key"],
+                    secret_key=conf["secret_key"], bucket=conf["bucket"], threshold=conf["threshold"],
+                    url_ttl=600, retention=1)
+store.check()
+
+short_param = 'gAVLAi4='
+long_param = base64.b64encode(os.urandom(conf["threshold"])).decode()
+
+execution_requests = [{"request_id": "object-store-test", "payload": {"params": [short_param, long_param]}}]
+store.offload(execution_requests)
+
+payload = execution_requests[0]["payload"]
+logger.debug(payload)
+
+# short parameters travel in the execution request
+assert payload["params"][0] == short_param
+
+# the SR downloads long parameters
+reference = payload["params"][1]
+response = requests.get(reference["url"])
+response.raise_for_status()
+
+assert response.text == long_param
+assert hashlib.sha256(response.content).hexdigest() == reference["sha256"]
+logger.info(f"Downloaded parameter {reference['key']} of {reference['size']} bytes")
+
+# the SR uploads long results, which the device downloads
+result_object = payload["result_object"]
+result = os.urandom(conf["threshold"] * 2)
+requests.put(result_object["upload_url"], data=result).raise_for_status()
+
+response = requests.get(result_object["url"])
+response.raise_for_status()
+
+assert response.content == result
+logger.info(f"Downloaded result {result_object['key']} of {len(result)} bytes")
+
+# function code sent by hash is downloaded by the SR
+function_code = FunctionCodeStore(object_store=store, ttl=600, size=1)
+execution_request = function_code.by_hash({"request_id": "function-code-test", "payload": {"fc": short_param}})
+payload = execution_request["payload"]
+
+assert "fc" not in payload
+
+response = requests.get(payload["fc_url"])
+response.raise_for_status()
+
+assert response.text == short_param
+assert hashlib.sha256(response.content).hexdigest() == payload["fc_hash"]
+logger.info(f"Downloaded function code {payload['fc_hash']}")
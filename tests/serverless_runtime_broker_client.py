@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import hashlib
 import json
 import pika
 from pika.adapters.blocking_connection import BlockingChannel
@@ -10,14 +11,17 @@ import requests
 
 import tests_common as tests
 
-def sr_offload(offload_request: dict) -> str:
+import wire  # noqa: E402
+
+
+def sr_offload(offload_request: dict) -> dict:
     """Serverless Runtime faas requests client.
 
     Args:
         offload_request (dict): dictionary with ExecSync params as required by the Serverless Runtime API
 
     Returns:
-        str: result dictionary containing the return code and the body of the execution
+        dict: result dictionary containing the return code and the body of the execution
     """
     logger.info(f"Sending function offload to {SR_ENDPOINT}")
     logger.debug(offload_request)
@@ -31,20 +35,92 @@ def sr_offload(offload_request: dict) -> str:
         "message": response.json()
     }
 
-    return json.dumps(result)
+    return result
+
+
+def download_parameter(reference: dict) -> str:
+    """Download a parameter stored in the object store by the edge cluster frontend"""
+    response = requests.get(reference["url"])
+    response.raise_for_status()
+
+    if hashlib.sha256(response.content).hexdigest() != reference["sha256"]:
+        raise Exception(f"Corrupted parameter {reference['key']}")
+
+    return response.text
+
+
+def upload_result(result: dict, result_object: dict) -> dict:
+    """Store a long result message in the object store, replacing it by a reference"""
+    message = json.dumps(result["message"]).encode()
+
+    if len(message) <= result_object["threshold"]:
+        return result
+
+    requests.put(result_object["upload_url"], data=message).raise_for_status()
+
+    logger.info(f"Uploaded {len(message)} bytes result to {result_object['key']}")
+
+    result["message"] = {
+        "key": result_object["key"],
+        "sha256": hashlib.sha256(message).hexdigest(),
+        "size": len(message),
+        "url": result_object["url"]
+    }
+
+    return result
+
+
+def function_code(offload_request: dict) -> str | None:
+    """Code of the function to execute, downloaded from the object store and kept when the
+    request only carries its hash
+    """
+    if "fc" in offload_request:
+        fc = offload_request["fc"]
+        FUNCTION_CODES[hashlib.sha256(fc.encode()).hexdigest()] = fc
+
+        return fc
+
+    fc_hash = offload_request["fc_hash"]
+
+    if fc_hash not in FUNCTION_CODES:
+        response = requests.get(offload_request["fc_url"])
+
+        if response.status_code != 200 or hashlib.sha256(response.content).hexdigest() != fc_hash:
+            logger.info(f"Function code {fc_hash} not available")
+            return None
+
+        FUNCTION_CODES[fc_hash] = response.text
+
+    return FUNCTION_CODES[fc_hash]
 
 
 def subscriber_function(channel: BlockingChannel, method, properties, body):
     """Function used as callback when opening a channel for consumption. It contains the execution request handling and result delivery logic.
     """
-    execution_request = json.loads(body)
+    # requests are msgpack or JSON, results are sent back in the same encoding
+    content_type = properties.content_type
+    execution_request = wire.decode(body, content_type)
     request_id = execution_request["request_id"]
 
     logger.info(f"Received execution request {request_id}")
 
     # Offload execution request to the SR after the message has been received
     offload_request = execution_request["payload"]
-    result = sr_offload(offload_request)
+    # long parameters and results are exchanged through the object store
+    result_object = offload_request.pop("result_object", None)
+    offload_request["params"] = [download_parameter(param) if isinstance(param, dict) else param
+                                 for param in offload_request["params"]]
+
+    offload_request["fc"] = function_code(offload_request)
+
+    if offload_request["fc"] is None:
+        # the edge cluster frontend sends the request again with the code
+        result = {"code": 412, "message": "Function code not available"}
+    else:
+        result = sr_offload(offload_request)
+
+    if result_object is not None:
+        result = upload_result(result, result_object)
 
     logger.info("Results ready")
     logger.debug(result)
@@ -53,7 +129,8 @@ def subscriber_function(channel: BlockingChannel, method, properties, body):
     channel.basic_publish(
         exchange='results',
         routing_key=request_id,
-        body=result
+        body=wire.encode(result, content_type),
+        properties=pika.BasicProperties(content_type=content_type)
     )
 
     channel.basic_ack(delivery_tag=method.delivery_tag)
@@ -90,6 +167,8 @@ SR_ENDPOINT = 'http://[::]:8000' # could be hardcoded as the SR API and the SR b
 
 logger = tests.logger
 
+FUNCTION_CODES = {}  # code of the functions executed, by SHA-256
+
 # Initialize connection
 connection = connect_to_broker(BROKER)
 